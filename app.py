@@ -1,9 +1,11 @@
 import os
-import re
+import uuid
 import random
 import time
-from datetime import date, timedelta, datetime
-from dash import dcc, html, dash_table, ALL, State, ctx
+import hashlib
+from functools import lru_cache
+from datetime import date, timedelta
+from dash import dcc, html, dash_table, ALL, MATCH, State, ctx, ClientsideFunction, no_update
 from dash.exceptions import PreventUpdate
 from dash_extensions.enrich import Output, DashProxy, Input, MultiplexerTransform
 import dash_daq as daq
@@ -11,14 +13,20 @@ import plotly.express as px
 import dash_bootstrap_components as dbc
 import json
 import gunicorn
-from bs4 import BeautifulSoup
-import requests
+from flask import request
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import URL
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from derive_scouting_features import damage_done_before_death, damage_taken
+from data_store import encode_frames, get_pool
+from session_cache import get_frame, put_frame
+from filter_engine import filter_kills, weapon_options
+from features import DAMAGE_FEATURES, ROUND_FEATURES, compute_features, pool_features
+from db import VIS_DATABASE, get_engine, read_engine
+from match_pool import fetch_match_pool
+from hltv_links import prefetch_links
+from match_info import match_table, select_matches
+from metrics import add_metrics_route, instrument_callbacks
 from plot_csgo import *
 
 # multiplexer transfrom lets us have multiple callbacks target the same output.
@@ -30,6 +38,27 @@ app = DashProxy(__name__,
 
 server = app.server
 
+# where the match pool comes from, "local" (the data store, see data_store.py)
+# or "db" (Postgres, see match_pool.py, which also has the match metadata for HLTV links)
+POOL_SOURCE = os.environ.get("POOL_SOURCE", "local")
+
+# time every callback below, served on /metrics
+instrument_callbacks(app)
+add_metrics_route(server)
+
+# read every radar image once per worker, rather than on every plot
+preload_radars()
+
+
+@server.after_request
+def cache_radars(response):
+    # radar urls carry the file's modification time, so browsers can keep them
+    if request.path.startswith("/" + MAP_IMAGE_URL) and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000  # 1 year
+    return response
+
 
 # Quick breakdown of dash: The app.layout is the static part,
 # and the functions after are what makes the page dynamic.
@@ -54,7 +83,7 @@ display_cols = [
 ]
 
 # This defines the layout of the app, using html and dash's premade elements
-app.layout = html.Div(
+layout = html.Div(
     [
         html.Div(
             className="box",
@@ -726,11 +755,21 @@ app.layout = html.Div(
         dcc.Store(id="dumped_filtered_kills_table"),
         dcc.Store(id="dumped-load-table"),
         dcc.Store(id="player-selector-load"),
+        dcc.Store(id="team-selector-versions"),
         dcc.Store(id="selected-match-table-load"),
         html.Div(id="placeholder"),
     ]
 )
 
+
+def serve_layout():
+    # every page load gets its own session id, the dumped_* stores only
+    # hold keys into the server-side frame cache, which is budgeted per session
+    return html.Div([layout, dcc.Store(id="session-id", data=uuid.uuid4().hex)])
+
+
+app.layout = serve_layout
+
 # Now we have a bunch of functions that make the static layout dynamic.
 
 
@@ -741,19 +780,11 @@ app.layout = html.Div(
     Input("save-vis-button", "n_clicks"),
     Input("delete-vis-button", "n_clicks"),
     Input("open", "n_clicks"),
+    State("session-id", "data"),
 )
-def fill_load_table(n1, n2, n3):
+def fill_load_table(n1, n2, n3, session_id):
     time.sleep(0.5)
-    # url_object = URL.create(
-    #     "postgresql+psycopg2",
-    #     host=os.environ["DB_HOST"],
-    #     database="eg_gaming_dev",
-    #     port=os.environ["DB_PORT"],
-    #     username=os.environ["DB_USER"],
-    #     password=os.environ["DB_PASSWORD"],
-    # )
-
-    # engine = create_engine(url_object)
+    # engine = get_engine(VIS_DATABASE)
 
     # fill_load_table_query = """ SELECT * FROM CSGO_DATA_VIS.SAVED_VIS """
 
@@ -777,7 +808,7 @@ def fill_load_table(n1, n2, n3):
 
     return (
         df[["Date Created", "Name", "Created by", "Notes"]].to_dict("records"),
-        df.to_json(),
+        put_frame(session_id, df),
     )
 
 
@@ -826,7 +857,7 @@ def toggle_modal(n1, n2, n3, is_open):
 )
 def load_vis(selected, data, n):
     if selected != [] and ctx.triggered_id == "load-vis-button" and ctx.triggered_id != "load-vis-button": #add for disable
-        df = pd.read_json(data)
+        df = get_frame(data)
         settings = df.loc[selected[0]]["settings"]
         return (
             settings["map"],
@@ -911,16 +942,7 @@ def save_vis(
             "kh_size": kh_size,
         }
 
-        url_object = URL.create(
-            "postgresql+psycopg2",
-            host=os.environ["DB_HOST"],
-            database="eg_gaming_dev",
-            port=os.environ["DB_PORT"],
-            username=os.environ["DB_USER"],
-            password=os.environ["DB_PASSWORD"],
-        )
-
-        engine = create_engine(url_object)
+        engine = get_engine(VIS_DATABASE)
 
         save_query = """ INSERT INTO csgo_data_vis.saved_vis(id,
                                                 name,
@@ -965,19 +987,10 @@ def save_vis(
 )
 def delete_vis(selected, data, n1):
     if selected != [] and ctx.triggered_id == "delete-vis-button" and ctx.triggered_id != "delete-vis-button": #add for disable
-        df = pd.read_json(data)
+        df = get_frame(data)
         to_delete = df.loc[selected[0]]
 
-        url_object = URL.create(
-            "postgresql+psycopg2",
-            host=os.environ["DB_HOST"],
-            database="eg_gaming_dev",
-            port=os.environ["DB_PORT"],
-            username=os.environ["DB_USER"],
-            password=os.environ["DB_PASSWORD"],
-        )
-
-        engine = create_engine(url_object)
+        engine = get_engine(VIS_DATABASE)
 
         delete_query = """ delete from csgo_data_vis.saved_vis
                         where 
@@ -1008,17 +1021,8 @@ def display_map_matches(
     map_string, selected_teams, selected_players, start_date, end_date
 ):
     time.sleep(0.5)
-    # sqlalchemy engine to make SQL fetches
-    # url_object = URL.create(
-    #     "postgresql+psycopg2",
-    #     host=os.environ["DB_HOST"],
-    #     database=os.environ["DB_NAME"],
-    #     port=os.environ["DB_PORT"],
-    #     username=os.environ["DB_USER"],
-    #     password=os.environ["DB_PASSWORD"],
-    # )
-
-    # engine = create_engine(url_object)
+    # pooled sqlalchemy engine to make SQL fetches
+    # engine = get_engine()
 
     # match_table_query = """ SELECT MATCH_ID,
     #                             MATCH_DATE,
@@ -1053,40 +1057,9 @@ def display_map_matches(
     ]
     rename_cols = {x: y for x, y in zip(read_cols, display_cols)}
 
-    df = pd.DataFrame(columns=read_cols)
-
-    if map_string == 'ancient':
-        data = pd.read_csv("data/game_round.csv")
-        data = data[data['map_name'] == 'de_ancient']
-        frame_players = pd.read_csv("data/frame_player.csv")
-        for match_id in data['match_id'].unique():
-            series = data[data['match_id'] == match_id]['series'].iloc[0]
-            match_date = data[data['match_id'] == match_id]['created_at'].apply(lambda x: x[:10]).iloc[0]
-            winning_team = data[data['match_id'] == match_id].winning_team.value_counts().sort_values(ascending=False).index[0]
-            losing_team = data[data['match_id'] == match_id].winning_team.value_counts().sort_values(ascending=False).index[1]
-            score = str(data[data['match_id'] == match_id].winning_team.value_counts().sort_values(ascending=False)[0]) + "-" + str(data[data['match_id'] == match_id].winning_team.value_counts().sort_values(ascending=False)[1])
-            round_wins = data[data['match_id'] == match_id][['winning_team', 'winning_side']].value_counts()
-            winning_t_wins = round_wins[winning_team]['T']
-            winning_ct_wins = round_wins[winning_team]['CT']
-            losing_t_wins = round_wins[losing_team]['T']
-            losing_ct_wins = (round_wins[losing_team]['CT'] if len(round_wins[losing_team]) == 2 else 0)
-            winning_players = frame_players[(frame_players['team']==winning_team) & (frame_players.match_id == match_id)]['name'].unique()
-            string = ''
-            for player in winning_players:
-                player = player.replace('nouns.', '')
-                player = player.replace('WC', '')
-                string += str(player) + ", "
-            string = string[:-2]
-            winning_players = string
-            losing_players = frame_players[(frame_players['team']==losing_team) & (frame_players.match_id == match_id)]['name'].unique()
-            string = ''
-            for player in losing_players:
-                player = player.replace('nouns.', '')
-                player = player.replace('WC', '')
-                string += str(player) + ", "
-            string = string[:-2]
-            losing_players = string
-            df.loc[len(df)] = [match_id, series, match_date, winning_team, losing_team, score, winning_t_wins, winning_ct_wins, losing_t_wins, losing_ct_wins, winning_players, losing_players]
+    # indexed query on MATCH_INFO, new matches get materialized into it first
+    df, index = match_table("de_" + map_string)
+    df = df[read_cols].rename(columns=rename_cols)
 
     # # Building match dataframe
     # df = pd.DataFrame(columns=read_cols)
@@ -1097,84 +1070,18 @@ def display_map_matches(
     # except SQLAlchemyError as e:
     #     print(e)
 
-    df.rename(columns=rename_cols, inplace=True)
-
     # # drop dups because ties mess up the SQL code
     # df.drop_duplicates(subset=["id"], inplace=True)
 
-    teams = list(set(df.winners.unique()) | set(df.losers.unique()))
-    winning_players = [
-        player.replace(",", "")
-        for players in [x.split() for x in df["winning players"]]
-        for player in players
-    ]
-    losing_players = [
-        player.replace(",", "")
-        for players in [x.split() for x in df["losing players"]]
-        for player in players
-    ]
-    players = list(set(winning_players) | set(losing_players))
-
-    # filter df based on selected date range
-    if start_date == None:
-        start_date = "1917-03-08"
-
-    df = df.loc[
-        [
-            (
-                datetime.strptime(str(x)[:10], "%Y-%m-%d")
-                <= datetime.strptime(end_date, "%Y-%m-%d")
-            )
-            and (
-                datetime.strptime(str(x)[:10], "%Y-%m-%d")
-                >= datetime.strptime(start_date, "%Y-%m-%d")
-            )
-            for x in df.date
-        ]
-    ]
-
-    # filter df based on selected players and teams
-    if selected_teams != []:
-        ids = list(
-            df.loc[
-                (df.winners == selected_teams[0]) | (df.losers == selected_teams[0])
-            ].id
-        )
-        if len(selected_teams) == 2:
-            ids = [
-                x
-                for x in ids
-                if x
-                in list(
-                    df.loc[
-                        (df.winners == selected_teams[1])
-                        | (df.losers == selected_teams[1])
-                    ].id
-                )
-            ]
-        elif len(selected_teams) > 2:
-            print("You can only select two teams.")
-        df = df.loc[df.id.isin(ids)]
-
-    if selected_players != []:
-        ids = []
-        for plyr in selected_players:
-            id = list(
-                df.loc[
-                    [
-                        x or y
-                        for x, y in zip(
-                            [plyr in z for z in df["winning players"]],
-                            [plyr in z for z in df["losing players"]],
-                        )
-                    ]
-                ].id
-            )
-            ids.append(id)
-
-        ids = set.intersection(*map(set, ids))
+    teams = sorted(index["teams"])
+    players = sorted(index["players"])
 
-        df = df.loc[df.id.isin(ids)]
+    # filter df based on selected date range, players and teams,
+    # i.e. the matches in the range all of them played in
+    rows = select_matches(
+        index, selected_teams or [], selected_players or [], start_date, end_date
+    )
+    df = df.iloc[rows]
 
     # Dash uses dictionaries to store data
     return df.to_dict("records"), teams, players
@@ -1270,151 +1177,84 @@ def func(data, map, n_clicks):
     Output("dumped_rounds_table", "data"),
     Output("loading-1", "children"),
     Output("loading-1", "fullscreen"),
+    Output("team-selector-versions", "data"),
     Input("selected-match-table", "data"),
     State("player-selector-load", "data"),
     Input("load-vis-button", "n_clicks"),
+    State("session-id", "data"),
+    State("team-selector-versions", "data"),
 )
-def show_teams(data, load_data, n1):
-    # sqlalchemy engine to make SQL fetches
-    # url_object = URL.create(
-    #     "postgresql+psycopg2",
-    #     host=os.environ["DB_HOST"],
-    #     database=os.environ["DB_NAME"],
-    #     port=os.environ["DB_PORT"],
-    #     username=os.environ["DB_USER"],
-    #     password=os.environ["DB_PASSWORD"],
-    # )
-
-    # engine = create_engine(url_object)
-
+def show_teams(data, load_data, n1, session_id, selector_versions):
     # building the dataframes
     kill_df = pd.DataFrame()
     round_df = pd.DataFrame()
     damage_df = pd.DataFrame()
     match_df = pd.DataFrame()
-
-    # function to fill match df with hltv link
-    def find_link(x):
-        search = "hltv " + str(x)
-        url = "https://www.google.com/search"
-
-        headers = {
-            "Accept": "*/*",
-            "Accept-Language": "en-US,en;q=0.5",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82",
-        }
-        parameters = {"q": search}
-
-        content = requests.get(url, headers=headers, params=parameters, timeout=10).text
-        soup = BeautifulSoup(content, "html.parser")
-
-        search = soup.find(id="search")
-        first_link = search.find("a")
-
-        return first_link["href"]
+    kills_key = None
+    versions = None
+    # the materialized features are keyed by the local store's row ids
+    from_db = False
 
     if data is not None:
         match_ids = [data[i]["id"] for i in range(len(data))]
         serieses = [data[i]["series"] for i in range(len(data))]
 
-        kill_df_big = pd.read_csv('data/kills.csv')
-        for id, series in zip(match_ids, serieses):
-            kill_df = pd.concat([kill_df, kill_df_big[(kill_df_big.match_id == id) & (kill_df_big.series == series)]], axis=0)
-        round_df_big = pd.read_csv('data/game_round.csv')
-        for id, series in zip(match_ids, serieses):
-            round_df = pd.concat([round_df, round_df_big[(round_df_big.match_id == id) & (round_df_big.series == series)]], axis=0)
-        damage_df_big = pd.read_csv('data/damage.csv')
-        for id, series in zip(match_ids, serieses):
-            damage_df = pd.concat([damage_df, damage_df_big[(damage_df_big.match_id == id) & (damage_df_big.series == series)]], axis=0)
-        
-
-        # match_query_string = "("
-        # for i in match_ids:
-        #     match_query_string += "'" + i + "',"
-        # match_query_string = match_query_string[:-1]
-        # match_query_string += ")"
-        # kill_table_query = """ SELECT *
-        #                     FROM CSGO_DSA.HLTV_KILL
-        #                     WHERE MATCH_ID IN {string}
-        #                     ORDER BY MATCH_ID, TICK ASC
-        # """.format(
-        #     string=match_query_string
-        # )
-        # round_table_query = """ SELECT *
-        #                     FROM CSGO_DSA.HLTV_GAME_ROUND
-        #                     WHERE MATCH_ID IN {string}
-        #                     ORDER BY MATCH_ID
-        # """.format(
-        #     string=match_query_string
-        # )
-        # damage_table_query = """ SELECT *
-        #                     FROM CSGO_DSA.HLTV_DAMAGE
-        #                     WHERE MATCH_ID IN {string}
-        #                     ORDER BY MATCH_ID
-        # """.format(
-        #     string=match_query_string
-        # )
-        # match_table_query = """ SELECT MATCH_URN as ID,
-        #                     extra_metadata as metadata
-        #                     FROM CSGO_DSA.MATCH_GAME
-        #                     WHERE MATCH_URN IN {string}
-        #                     ORDER BY ID
-        # """.format(
-        #     string=match_query_string
-        # )
-
-        # if match_ids != []:
-        #     try:
-        #         output = engine.execute(kill_table_query)
-        #         kill_df = pd.DataFrame(output.fetchall())
-        #         output = engine.execute(round_table_query)
-        #         round_df = pd.DataFrame(output.fetchall())
-        #         output = engine.execute(damage_table_query)
-        #         damage_df = pd.DataFrame(output.fetchall())
-        #         output = engine.execute(match_table_query)
-        #         match_df = pd.DataFrame(output.fetchall())
-        #     except SQLAlchemyError as e:
-        #         print(e)
-        #         print("kill/round/damage table pull failed")
+        if POOL_SOURCE == "db" and match_ids != []:
+            # pooled connections, on the read replica if there's one
+            try:
+                pool = fetch_match_pool(zip(match_ids, serieses), read_engine())
+                kill_df, round_df, damage_df = encode_frames(
+                    [pool["kills"], pool["game_round"], pool["damage"]]
+                )
+                match_df = pool["match"]
+                from_db = True
+            except Exception as e:
+                print(e)
+                print("kill/round/damage table pull failed, using the local data")
+
+        if not from_db:
+            kill_df, round_df, damage_df = get_pool(zip(match_ids, serieses))
 
         if not kill_df.empty and not round_df.empty:
-            # add some features from scripts in derive_scouting_features
-            kill_df["damage_done_before_death"] = kill_df.apply(
-                lambda x: damage_done_before_death(x, damage_df), axis=1
-            )
-            kill_df["damage_taken"] = kill_df.apply(
-                lambda x: damage_taken(x, damage_df), axis=1
-            )
-            kill_df["net_dmg"] = (
-                kill_df["damage_done_before_death"] - kill_df["damage_taken"]
-            )
+            # add the features from scripts in derive_scouting_features,
+            # these are computed once per match and read back from features.py,
+            # kills fetched from the DB have no local row ids so theirs are computed here
+            if from_db:
+                features = compute_features(kill_df, round_df, damage_df)
+            else:
+                features = pool_features(zip(match_ids, serieses), kill_df.index)
+            kill_df = kill_df.join(features[DAMAGE_FEATURES])
 
-            # add hltv link for each kill
-            # id_to_hltv = {
-            #     x: find_link(y)
-            #     for x, y in zip(list(match_df.id), [x['source_match_filename'] for x in match_df.metadata])
-            # }
             #use this since seems there's a bug in the code
             kill_df = kill_df.dropna()
-            #  kill_df["hltv_link"] = [id_to_hltv[x] for x in kill_df["match_id"]]
+
+            # add hltv link for each kill, from the link cache, links that
+            # aren't resolved yet get looked up in the background
+            if not match_df.empty:
+                id_to_file = {
+                    x: y["source_match_filename"]
+                    for x, y in zip(match_df.id, match_df.metadata)
+                }
+                links = prefetch_links(id_to_file.values())
+                kill_df["source_match_filename"] = kill_df.match_id.map(id_to_file)
+                kill_df["hltv_link"] = kill_df.source_match_filename.map(links)
             teams = list(kill_df.attacker_team.unique())
-            
-            def true_round_time(x):
-                # need this function to get true time from start of round in seconds
-                round_start_tick = max(
-                    round_df.loc[
-                        (round_df.match_id == x.match_id)
-                        & (round_df.start_tick < x.tick)
-                    ].start_tick
-                )
-                return round((x.tick - round_start_tick) / 128, 1)
 
-            # Add true round time to dataframe
-            kill_df["true_round_time"] = kill_df.apply(
-                true_round_time, axis=1
-            )
+            # Add true round time, round buy types and victim sides to dataframe
+            kill_df = kill_df.join(features[ROUND_FEATURES])
 
-            # populate the player selection table
+            # populate the player selection table, one column per team,
+            # each column is rendered by render_team_selector from its store,
+            # which only holds the team and the key of the cached kills
+            kill_df.reset_index(inplace=True)
+            kills_key = put_frame(session_id, kill_df)
+            options = weapon_options(kill_df)
+            versions = {
+                team: hashlib.sha1(
+                    json.dumps(options[team], sort_keys=True).encode()
+                ).hexdigest()
+                for team in teams
+            }
             children = html.Div(
                 style={"width": "100%"},
                 children=[
@@ -1433,100 +1273,16 @@ def show_teams(data, load_data, n1):
                                         "text-align": "center",
                                     },
                                     children=[
-                                        html.Div(
-                                            children=[
-                                                html.Div(team),
-                                                html.Button(
-                                                    "T",
-                                                    id={
-                                                        "type": "T-button",
-                                                        "index": team,
-                                                    },
-                                                    n_clicks=0,
-                                                ),
-                                                html.Button(
-                                                    "CT",
-                                                    id={
-                                                        "type": "CT-button",
-                                                        "index": team,
-                                                    },
-                                                    n_clicks=0,
-                                                ),
-                                                html.Button(
-                                                    "Both",
-                                                    id={
-                                                        "type": "both-button",
-                                                        "index": team,
-                                                    },
-                                                    n_clicks=0,
-                                                ),
-                                                dcc.Dropdown(
-                                                    id={
-                                                        "type": "team-filter-weapon",
-                                                        "index": team,
-                                                    },
-                                                    style={"padding-top": "10px"},
-                                                    options=sorted(
-                                                        kill_df.loc[
-                                                            kill_df.attacker_team
-                                                            == team
-                                                        ].weapon.unique()
-                                                    ),
-                                                    multi=True,
-                                                    placeholder="all",
-                                                ),
-                                            ],
-                                            style={
-                                                "padding": "10px",
-                                                "border-bottom": "2px solid black",
+                                        dcc.Store(
+                                            id={
+                                                "type": "team-selector-data",
+                                                "index": team,
                                             },
-                                        )
-                                    ]
-                                    + [
+                                            data={"team": team, "kills": kills_key},
+                                        ),
                                         html.Div(
-                                            [
-                                                html.Div(
-                                                    style={
-                                                        "padding": "10px 10px 0 10px"
-                                                    },
-                                                    id={
-                                                        "type": "player-name",
-                                                        "index": "index",
-                                                    },
-                                                    children=player,
-                                                ),
-                                                dcc.Checklist(
-                                                    id={
-                                                        "type": "player-filter-checklist",
-                                                        "index": team + "&" + player,
-                                                    },
-                                                    options=["T", "CT"],
-                                                    value=["T", "CT"],
-                                                ),
-                                                dcc.Dropdown(
-                                                    id={
-                                                        "type": "player-filter-weapon",
-                                                        "index": player,
-                                                    },
-                                                    style={
-                                                        "padding-bottom": "10px",
-                                                        "padding-right": "10px",
-                                                        "padding-left": "10px",
-                                                    },
-                                                    options=sorted(
-                                                        kill_df.loc[
-                                                            kill_df.attacker_name
-                                                            == player
-                                                        ].weapon.unique()
-                                                    ),
-                                                    multi=True,
-                                                    placeholder="all",
-                                                ),
-                                            ]
-                                        )
-                                        for player in kill_df.loc[
-                                            kill_df.attacker_team == team
-                                        ].attacker_name.unique()
+                                            id={"type": "team-selector", "index": team}
+                                        ),
                                     ],
                                 )
                                 for team in teams
@@ -1535,7 +1291,9 @@ def show_teams(data, load_data, n1):
                     )
                 ],
             )
-            kill_df.reset_index(inplace=True)
+            # same teams, players and weapons, the columns (and their filters) stay
+            if versions == selector_versions:
+                children = no_update
         else:
             teams = []
 
@@ -1555,8 +1313,124 @@ def show_teams(data, load_data, n1):
     # loading option
     if ctx.triggered_id == "load-vis-button" and load_data is not None:
         children = load_data
+        versions = None
+
+    return (
+        children,
+        weapons,
+        kills_key if kills_key is not None else put_frame(session_id, kill_df),
+        put_frame(session_id, round_df),
+        [],
+        False,
+        versions,
+    )
+
+@lru_cache(maxsize=64)
+def team_options(kills_key):
+    """
+    Returns the weapon_options of the cached kills under kills_key,
+    computed once per pool (the frame of a key never changes).
+    """
+    return weapon_options(get_frame(kills_key))
+
+
+# render one team's column of the player selector
+@app.callback(
+    Output({"type": "team-selector", "index": MATCH}, "children"),
+    Input({"type": "team-selector-data", "index": MATCH}, "data"),
+    State({"type": "team-selector", "index": MATCH}, "children"),
+    # has to run when show_teams inserts the column
+    prevent_initial_call=False,
+)
+def render_team_selector(data, children):
+    # columns restored from a saved visualization keep their filters
+    if data is None or children:
+        raise PreventUpdate
+
+    team = data["team"]
+    data = team_options(data["kills"])[team]
+    return [
+        html.Div(
+            children=[
+                html.Div(team),
+                html.Button(
+                    "T",
+                    id={
+                        "type": "T-button",
+                        "index": team,
+                    },
+                    n_clicks=0,
+                ),
+                html.Button(
+                    "CT",
+                    id={
+                        "type": "CT-button",
+                        "index": team,
+                    },
+                    n_clicks=0,
+                ),
+                html.Button(
+                    "Both",
+                    id={
+                        "type": "both-button",
+                        "index": team,
+                    },
+                    n_clicks=0,
+                ),
+                dcc.Dropdown(
+                    id={
+                        "type": "team-filter-weapon",
+                        "index": team,
+                    },
+                    style={"padding-top": "10px"},
+                    options=data["weapons"],
+                    multi=True,
+                    placeholder="all",
+                ),
+            ],
+            style={
+                "padding": "10px",
+                "border-bottom": "2px solid black",
+            },
+        )
+    ] + [
+        html.Div(
+            [
+                html.Div(
+                    style={"padding": "10px 10px 0 10px"},
+                    id={
+                        "type": "player-name",
+                        "index": "index",
+                    },
+                    children=player,
+                ),
+                dcc.Checklist(
+                    id={
+                        "type": "player-filter-checklist",
+                        "index": team + "&" + player,
+                    },
+                    options=["T", "CT"],
+                    value=["T", "CT"],
+                ),
+                dcc.Dropdown(
+                    id={
+                        "type": "player-filter-weapon",
+                        "index": player,
+                    },
+                    style={
+                        "padding-bottom": "10px",
+                        "padding-right": "10px",
+                        "padding-left": "10px",
+                    },
+                    options=weapons,
+                    multi=True,
+                    placeholder="all",
+                ),
+            ]
+        )
+        for player, weapons in data["players"]
+    ]
 
-    return children, weapons, kill_df.to_json(), round_df.to_json(), [], False
 
 # update player selector with button presses
 @app.callback(
@@ -1625,6 +1499,7 @@ def select_T_CT(ids, values, x1, x2, x3, x3_ids, n1, n2, both_sides):
     Input({"type": "team-filter-weapon", "index": ALL}, "value"),
     Input("all-filter-weapon", "value"),
     Input("net-dmg-slider", "value"),
+    State("session-id", "data"),
 )
 def filter_table(
     data,
@@ -1639,144 +1514,43 @@ def filter_table(
     team_weapons,
     all_weapons,
     net_dmg,
+    session_id,
 ):
-    if rounds == "":
-        rounds = np.arange(1, 32)
-    else:
-        # interpret round selector input, find numbers and dashes
-        a = re.findall(r"(\d+|-)", rounds)
-        dash_indices = [i for i, x in enumerate(a) if x == "-"]
-        list_rounds = [x for x in a if x != "-"]
-        for ind in dash_indices:
-            if ind != len(list_rounds):
-                list_rounds += [str(x) for x in range(int(a[ind - 1]), int(a[ind + 1]))]
-        list_rounds = sorted(list_rounds)
-        # remove duplicates
-        list_rounds = [*set(list_rounds)]
-        rounds = [int(x) - 1 for x in list_rounds]
-
-    df = pd.read_json(data)
-    round_df = pd.read_json(round_data)
-
-    def round_type(x):
-        """
-        finds type of round for a given kill
-        """
-        round = (
-            round_df.loc[
-                (round_df.match_id == x.match_id) & (round_df.start_tick <= x.tick)
-            ]
-            .sort_values(by=["start_tick"], ascending=False)
-            .iloc[0]
-        )
-
-        t_type = round.t_buy_type
-        ct_type = round.ct_buy_type
-
-        return [t_type, ct_type]
-
-    df_victim, df_attacker = pd.DataFrame(), pd.DataFrame()
-    
-    if not df.empty:
-        # time filter
-        df = df.loc[(df.true_round_time > time[0]) & (df.true_round_time < time[1])]
-
-        # net dmg filter
-        df = df.loc[(df.net_dmg > net_dmg[0]) & (df.true_round_time < net_dmg[1])]
-
-        # round filter
-        df = df.loc[df.round_num.isin(rounds)]
-
-        # add victim info
-        def victim_side(x):
-            if x["is_teamkill"]:
-                return x["attacker_side"]
-            elif x["attacker_side"] == "T":
-                return "CT"
-            else:
-                return "T"
-
-        if not df.empty:  # apply throws error if df is empty
-            df["victim_side"] = df.apply(victim_side, axis=1)
-            # round type filter
-            df["t_round_type"] = df.apply(lambda x: round_type(x)[0], axis=1)
-            df["ct_round_type"] = df.apply(lambda x: round_type(x)[1], axis=1)
+    def translate_buy(x):
+        if x == "T full" or x == "CT full":
+            return "Full Buy"
+        elif x == "T half" or x == "CT half":
+            return "Half Buy"
+        elif x == "T full eco" or x == "CT full eco":
+            return "Full Eco"
         else:
-            df["victim_side"] = pd.NA
-            df["t_round_type"] = pd.NA
-            df["ct_round_type"] = pd.NA
-
-        if buy_type is not None:
-
-            def translate_buy(x):
-                if x == "T full" or x == "CT full":
-                    return "Full Buy"
-                elif x == "T half" or x == "CT half":
-                    return "Half Buy"
-                elif x == "T full eco" or x == "CT full eco":
-                    return "Full Eco"
-                else:
-                    return "Eco"
-
-            CT_types = [type for type in buy_type if "CT" in type]
-            T_types = [type for type in buy_type if not type in CT_types]
-            CT_types = [translate_buy(type) for type in CT_types]
-            T_types = [translate_buy(type) for type in T_types]
-
-            if T_types != []:
-                df = df.loc[df.t_round_type.isin(T_types)]
-            if CT_types != []:
-                df = df.loc[df.ct_round_type.isin(CT_types)]
-
-        # add player weapon filter
-        player_wep_dict = {x: y for x, y in zip(players, player_weapons)}
-        for player in players:
-            if player_wep_dict[player] is not None:
-                df.drop(
-                    df.loc[
-                        (df.attacker_name == player)
-                        & ~df.weapon.isin(player_wep_dict[player])
-                    ].index,
-                    inplace=True,
-                )
-
-        # add team weapon filter
-        teams = [x["index"] for x in team_weapons_id]
-        team_wep_dict = {x: y for x, y in zip(teams, team_weapons)}
-        for team in teams:
-            if team_wep_dict[team] is not None:
-                df.drop(
-                    df.loc[
-                        (df.attacker_team == team)
-                        & ~df.weapon.isin(team_wep_dict[team])
-                    ].index,
-                    inplace=True,
-                )
-
-        # add all weapon filter
-        if all_weapons is not None:
-            df.drop(df.loc[~df.weapon.isin(all_weapons)].index, inplace=True)
+            return "Eco"
+
+    CT_types, T_types = [], []
+    if buy_type is not None:
+        CT_types = [type for type in buy_type if "CT" in type]
+        T_types = [type for type in buy_type if not type in CT_types]
+        CT_types = [translate_buy(type) for type in CT_types]
+        T_types = [translate_buy(type) for type in T_types]
+
+    teams = [x["index"] for x in team_weapons_id]
+
+    # each filter is a cached mask, so only the ones whose control changed get recomputed
+    df_victim, df_attacker = filter_kills(
+        data,
+        get_frame(data),
+        time=time,
+        net_dmg=net_dmg,
+        rounds=rounds,
+        t_buy_types=T_types,
+        ct_buy_types=CT_types,
+        player_weapons={x: y for x, y in zip(players, player_weapons)},
+        team_weapons={x: y for x, y in zip(teams, team_weapons)},
+        all_weapons=all_weapons,
+        player_sides=list(zip(players, sides)),
+    )
 
-        df_victim = df.copy()
-        df_attacker = df.copy()
-
-        for player, side in zip(players, sides):
-            df_victim.drop(
-                df_victim.loc[
-                    (df_victim.victim_name == player)
-                    & (~df_victim.victim_side.isin(side))
-                ].index,
-                inplace=True,
-            )
-        for player, side in zip(players, sides):
-            df_attacker.drop(
-                df_attacker.loc[
-                    (df_attacker.attacker_name == player)
-                    & (~df_attacker.attacker_side.isin(side))
-                ].index,
-                inplace=True,
-            )
-    return [df_victim.to_json(), df_attacker.to_json()]
+    return [put_frame(session_id, df_victim), put_frame(session_id, df_attacker)]
 
 
 # make map plot with kills and deaths data
@@ -1788,12 +1562,12 @@ def filter_table(
     State("graph-tool", "value"),
     Input({"type": "graph", "index": ALL}, "clickData"),
     Input({"type": "graph", "index": ALL}, "selectedData"),
-    Input("ds-size-slider", "value"),
-    Input("ks-size-slider", "value"),
-    Input("dh-color", "value"),
-    Input("kh-color", "value"),
-    Input("dh-size-slider", "value"),
-    Input("kh-size-slider", "value"),
+    State("ds-size-slider", "value"),
+    State("ks-size-slider", "value"),
+    State("dh-color", "value"),
+    State("kh-color", "value"),
+    State("dh-size-slider", "value"),
+    State("kh-size-slider", "value"),
 )
 def make_graph(
     filtered_data,
@@ -1812,9 +1586,12 @@ def make_graph(
     """
     This function outputs the graphs. Note it has to make multiple
     if a map has two pngs associated with it (i.e. vertigo/nuke).
+    The palette options are only read here, changes to them are
+    applied in the browser by csgo.restyle (assets/restyle.js).
     """
     if filtered_data != None:
-        dfs = [pd.read_json(df) for df in filtered_data]
+        # copies, since the coordinates get rescaled in place
+        dfs = [get_frame(key).copy() for key in filtered_data]
     else:
         dfs = [pd.DataFrame(), pd.DataFrame()]
 
@@ -1823,12 +1600,7 @@ def make_graph(
 
     if not dfs[0].empty:
         # scale and filter the data based on options
-        x_shift, y_shift, s = find_scale(
-            map_dict[map_string + "_game_x"],
-            map_dict[map_string + "_game_y"],
-            map_dict[map_string + "_map_x"],
-            map_dict[map_string + "_map_y"],
-        )
+        x_shift, y_shift, s = get_radar(map_string)["transform"]
 
         for dff in dfs:
             dff["victim_x"] = (dff["victim_x"] - x_shift) * s
@@ -1960,8 +1732,7 @@ def make_graph(
                 )
             )
 
-    I_dim = Image.open("map_images/de_" + map_string + "_radar.jpg")
-    w, h = I_dim.size
+    w, h = get_radar(map_string)["size"]
 
     # update with palette options
     for fig in figs:
@@ -2038,6 +1809,20 @@ def make_graph(
     return graphs
 
 
+# restyle the graphs in the browser when a palette option changes (see assets/restyle.js)
+app.clientside_callback(
+    ClientsideFunction(namespace="csgo", function_name="restyle"),
+    Output({"type": "graph", "index": ALL}, "figure"),
+    Input("ds-size-slider", "value"),
+    Input("ks-size-slider", "value"),
+    Input("dh-color", "value"),
+    Input("kh-color", "value"),
+    Input("dh-size-slider", "value"),
+    Input("kh-size-slider", "value"),
+    State({"type": "graph", "index": ALL}, "figure"),
+)
+
+
 # make feature plot
 @app.callback(
     Output("scatter-plot", "figure"),
@@ -2054,7 +1839,7 @@ def scatter_plot(data, x, y, color, plot_type):
     placeholder = color
     fig = go.Figure()
     columns = []
-    dfs = [pd.read_json(d) for d in data]
+    dfs = [get_frame(key) for key in data]
     df = pd.concat([dfs[0], dfs[1]])
     df.drop_duplicates(inplace=True)
     plot_cols = []
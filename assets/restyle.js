@@ -0,0 +1,42 @@
+// Restyles the kill/death graphs in the browser when a palette control changes,
+// so dragging a size slider or color picker doesn't rebuild the figures on the server.
+// Mirrors the palette section of make_graph in app.py.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    csgo: {
+        restyle: function (dsSize, ksSize, dhColor, khColor, dhSize, khSize, figures) {
+            if (!figures || figures.length === 0) {
+                return window.dash_clientside.no_update;
+            }
+
+            function colorscale(color) {
+                const rgb = color.rgb;
+                const rgba = "rgba(" + rgb.r + "," + rgb.g + "," + rgb.b + "," + rgb.a + ")";
+                return [[0, "rgba(0,0,0,0)"], [1, rgba]];
+            }
+
+            function restyleTrace(trace) {
+                const t = Object.assign({}, trace);
+                const symbol = t.marker && t.marker.symbol;
+
+                if (symbol === "x") {
+                    t.marker = Object.assign({}, t.marker, {size: dsSize});
+                } else if (symbol === "circle" || symbol === "circle-open") {
+                    t.marker = Object.assign({}, t.marker, {size: ksSize});
+                }
+
+                if (t.name === "dh" || t.name === "kh") {
+                    const size = t.name === "dh" ? dhSize : khSize;
+                    t.colorscale = colorscale(t.name === "dh" ? dhColor : khColor);
+                    t.xbins = Object.assign({}, t.xbins, {size: size});
+                    t.ybins = Object.assign({}, t.ybins, {size: size});
+                }
+
+                return t;
+            }
+
+            return figures.map(function (figure) {
+                return Object.assign({}, figure, {data: figure.data.map(restyleTrace)});
+            });
+        }
+    }
+});
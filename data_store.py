@@ -0,0 +1,448 @@
+"""
+This is the in-process store for the match tables in data/.
+Each table is read once per worker and kept in memory, so the
+callbacks can ask for slices of it instead of re-reading the csv.
+The first read of a csv also writes a memory-mappable feather copy
+to data/.cache/, which is what later workers read instead, until
+the csv changes. Tables ingested with ingest.py are also split into one
+parquet file per match, those are read one match at a time without
+loading the whole table. Currently there's
+TABLES - dictionary of table names to their csv files
+has_table - function to check if a table exists on disk
+read_typed_csv - function to parse csv text with the dtypes of the tables
+encode_frames - function to put frames on the shared categorical dictionaries
+table_version - function to tell when a table's csv has changed
+convert_table - function to (re)build the binary copy of a table
+load_table - function to read (once) a typed table indexed by (match_id, series, row)
+read_manifest - function to get the per-match partitions of a table (see ingest.py)
+table_matches - function to list every match of a table, ingested or not
+data_version - function to tell when matches were added to a table's csv or partitions
+match_versions - function to tell when the rows of some matches of a table have changed
+get_matches - function to select a list of matches out of a table at once
+get_pool - function to get the kills, rounds and damage of a match pool
+
+Run this file to convert every table in data/ ahead of time.
+"""
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    # without pyarrow every worker just parses the csv files
+    feather = None
+
+DATA_DIR = "data"
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+
+TABLES = {
+    "kills": "kills.csv",
+    "damage": "damage.csv",
+    "game_round": "game_round.csv",
+    "frame": "frame.csv",
+    "frame_player": "frame_player.csv",
+    "flash": "flash.csv",
+    "nades": "nades.csv",
+    "bomb_events": "bomb_events.csv",
+}
+
+INDEX_COLS = ["match_id", "series"]
+
+# row ids of ingested rows start here, the csv row numbers (the row ids of
+# matches that aren't ingested) stay below it, so the two never overlap in a pool
+INGESTED_ROW_BASE = 2**40
+
+# string columns that only take a handful of values, these are stored as categoricals.
+# Columns of the same domain share one dictionary of categories across all tables,
+# so i.e. a kill's victim_name and a damage row's attacker_name have the same codes.
+CATEGORY_DOMAINS = {
+    "player": ["name", "attacker_name", "victim_name", "player_name", "thrower_name"],
+    "team": [
+        "team",
+        "attacker_team",
+        "player_team",
+        "player_traded_team",
+        "thrower_team",
+        "t_team",
+        "ct_team",
+        "winning_team",
+    ],
+    "side": ["attacker_side", "player_side", "thrower_side", "winning_side", "victim_side"],
+    "area": [
+        "attacker_area_name",
+        "victim_area_name",
+        "player_area_name",
+        "thrower_area_name",
+        "grenade_area_name",
+    ],
+    "weapon": ["weapon", "grenade_type"],
+    "buy_type": ["ct_buy_type", "t_buy_type", "ct_round_type", "t_round_type"],
+    "map_name": ["map_name"],
+    "round_end_reason": ["round_end_reason"],
+    "bomb_action": ["bomb_action"],
+    "bomb_site": ["bomb_site"],
+}
+
+CATEGORY_COLS = [col for cols in CATEGORY_DOMAINS.values() for col in cols]
+
+_domain_of = {col: domain for domain, cols in CATEGORY_DOMAINS.items() for col in cols}
+
+DATE_COLS = ["created_at"]
+
+# table name -> (version of its csv, table)
+_tables = {}
+_lock = threading.Lock()
+
+# domain -> categories, only ever appended to so codes given out never change
+_dictionaries = {domain: [] for domain in CATEGORY_DOMAINS}
+_dtypes = {}
+_dictionary_lock = threading.Lock()
+
+
+def partition_root(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def manifest_path(name):
+    return os.path.join(partition_root(name), "manifest.json")
+
+
+def partition_key(match_id, series):
+    return str(match_id) + "/" + str(series)
+
+
+def table_path(name):
+    return os.path.join(DATA_DIR, TABLES[name])
+
+
+def has_table(name):
+    return os.path.exists(table_path(name))
+
+
+def cache_path(name):
+    return os.path.join(CACHE_DIR, name + ".feather")
+
+
+def stamp_path(name):
+    return os.path.join(CACHE_DIR, name + ".json")
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def read_typed_csv(source, **kwargs):
+    """
+    Parses csv text (a path or a seekable buffer) with categorical
+    names/teams/weapons and parsed timestamps.
+    Other keyword arguments (i.e. chunksize) go to pd.read_csv.
+    """
+    header = pd.read_csv(source, nrows=0).columns
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+    return pd.read_csv(
+        source,
+        dtype={col: "category" for col in CATEGORY_COLS if col in header},
+        parse_dates=[col for col in DATE_COLS if col in header],
+        **kwargs,
+    )
+
+
+def shared_dtypes(frames):
+    """
+    Adds the values of the category columns of frames that aren't in their
+    domain's dictionary yet, and returns {domain: CategoricalDtype} of every domain.
+    """
+    with _dictionary_lock:
+        for df in frames:
+            for col in df.columns:
+                domain = _domain_of.get(col)
+                if domain is None:
+                    continue
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    values = df[col].cat.categories
+                else:
+                    values = pd.unique(df[col].dropna())
+                known = _dtypes[domain].categories if domain in _dtypes else pd.Index([])
+                new = pd.Index(values).difference(known, sort=False)
+                if len(new) or domain not in _dtypes:
+                    _dictionaries[domain].extend(new.tolist())
+                    _dtypes[domain] = pd.CategoricalDtype(_dictionaries[domain])
+
+        return dict(_dtypes)
+
+
+def encode_frames(frames):
+    """
+    Returns frames with every category column (see CATEGORY_DOMAINS) as a
+    categorical on its domain's shared dictionary, so the same value has the
+    same integer code in all of them, and they concat/compare/filter on codes.
+    """
+    dtypes = shared_dtypes(frames)
+
+    encoded = []
+    for df in frames:
+        # column by column on a shallow copy, so the other columns aren't copied
+        df = df.copy(deep=False)
+        for col in df.columns:
+            if col in _domain_of and df[col].dtype != dtypes[_domain_of[col]]:
+                df[col] = df[col].astype(dtypes[_domain_of[col]])
+        encoded.append(df)
+
+    return encoded
+
+
+def read_csv_table(name):
+    """
+    Parses a table from its csv with categorical names/teams/weapons and
+    parsed timestamps. The csv row number is kept in the "row" column,
+    it's the row's id in the app.
+    """
+    path = table_path(name)
+    df = read_typed_csv(path)
+    df.index.name = "row"
+
+    return df.reset_index()
+
+
+def convert_table(name):
+    """
+    Parses the csv of a table and writes its binary copy to the cache,
+    along with a stamp of the csv it came from. Returns the parsed table.
+    The copy is sorted by (match_id, series, row), so reading it needs no sort.
+    """
+    df = read_csv_table(name).sort_values(INDEX_COLS + ["row"], ignore_index=True)
+    if feather is None:
+        return df
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    source = table_path(name)
+    stamp = {
+        "mtime": os.stat(source).st_mtime,
+        "size": os.stat(source).st_size,
+        "sha1": file_hash(source),
+        "sorted": True,
+    }
+    # write to temp files first so other workers never see half a file
+    tmp = "." + str(os.getpid()) + ".tmp"
+    feather.write_feather(df, cache_path(name) + tmp, compression="uncompressed")
+    with open(stamp_path(name) + tmp, "w") as f:
+        json.dump(stamp, f)
+    os.replace(cache_path(name) + tmp, cache_path(name))
+    os.replace(stamp_path(name) + tmp, stamp_path(name))
+
+    return df
+
+
+def cache_is_fresh(name):
+    """
+    Checks the binary copy of a table against its csv. A changed mtime
+    alone only costs a hash of the csv, the copy is rebuilt if the hash
+    differs too.
+    """
+    if feather is None or not os.path.exists(cache_path(name)):
+        return False
+    try:
+        with open(stamp_path(name)) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not stamp.get("sorted"):
+        # written before the copies were sorted
+        return False
+
+    source = table_path(name)
+    if os.stat(source).st_mtime == stamp["mtime"] and os.stat(source).st_size == stamp["size"]:
+        return True
+    if file_hash(source) != stamp["sha1"]:
+        return False
+
+    # csv was touched but not changed
+    stamp["mtime"] = os.stat(source).st_mtime
+    tmp = stamp_path(name) + "." + str(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(stamp, f)
+    os.replace(tmp, stamp_path(name))
+
+    return True
+
+
+def read_table(name):
+    """
+    Reads a table from its binary copy (memory-mapped) if it's up to date,
+    otherwise from the csv, rebuilding the copy. The result has a sorted
+    (match_id, series, row) index.
+    """
+    if cache_is_fresh(name):
+        # split_blocks lets numeric columns stay views on the mapped file
+        df = feather.read_table(cache_path(name), memory_map=True).to_pandas(split_blocks=True)
+    else:
+        df = convert_table(name)
+
+    df.set_index(INDEX_COLS + ["row"], inplace=True)
+    if not df.index.is_monotonic_increasing:
+        df.sort_index(inplace=True)
+
+    return encode_frames([df])[0]
+
+
+def table_version(name):
+    """
+    Returns the (mtime, size) of a table's csv, which changes whenever the csv does.
+    """
+    st = os.stat(table_path(name))
+    return (st.st_mtime, st.st_size)
+
+
+def load_table(name):
+    """
+    Returns the in-memory copy of a table, reading it the first time it's asked for
+    (and again if its csv changed since).
+    The returned frame is shared between callbacks, so don't modify it in place.
+    """
+    version = table_version(name)
+    if name not in _tables or _tables[name][0] != version:
+        with _lock:
+            if name not in _tables or _tables[name][0] != version:
+                _tables[name] = (version, read_table(name))
+
+    return _tables[name][1]
+
+
+def read_manifest(name):
+    """
+    Returns the manifest of a table's partitions:
+    {"next_row": first free row id, "partitions": {"match_id/series": partition}},
+    where each partition has its map_name, match_id, series, path (relative
+    to data/<table>/) and number of rows. Tables that were never ingested
+    have no partitions.
+    """
+    try:
+        with open(manifest_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"next_row": INGESTED_ROW_BASE, "partitions": {}}
+
+
+def table_matches(name):
+    """
+    Returns every (match_id, series) of a table, ingested or in its csv, sorted.
+    """
+    keys = {
+        (partition["match_id"], partition["series"])
+        for partition in read_manifest(name)["partitions"].values()
+    }
+    if has_table(name):
+        keys |= set(load_table(name).index.droplevel("row").unique())
+
+    return sorted(keys)
+
+
+def data_version(name):
+    """
+    Returns the versions of a table's csv and manifest, which change whenever a
+    match is added to either. Either is None if the table doesn't have it,
+    i.e. in a deployment where the data only lives in the database.
+    """
+    manifest = None
+    if os.path.exists(manifest_path(name)):
+        st = os.stat(manifest_path(name))
+        manifest = (st.st_mtime, st.st_size)
+
+    return (table_version(name) if has_table(name) else None, manifest)
+
+
+def match_versions(name, keys):
+    """
+    Returns {"match_id/series": [mtime, size]} of the file each match's rows of a
+    table are read from, its partition if it was ingested, otherwise the
+    table's csv (None if the table has neither), which change whenever the rows do.
+    """
+    partitions = read_manifest(name)["partitions"]
+    csv_version = list(table_version(name)) if has_table(name) else None
+
+    versions = {}
+    for match_id, series in keys:
+        key = partition_key(match_id, series)
+        if key in partitions:
+            st = os.stat(os.path.join(partition_root(name), partitions[key]["path"]))
+            versions[key] = [st.st_mtime, st.st_size]
+        else:
+            versions[key] = csv_version
+
+    return versions
+
+
+def _partition_frame(name, manifest, partition):
+    """
+    Reads one partition of a table, indexed by row id. Partitions written before
+    INGESTED_ROW_BASE get their row ids moved above it, like ingest.py does on disk.
+    """
+    df = pd.read_parquet(os.path.join(partition_root(name), partition["path"]))
+    if manifest["next_row"] < INGESTED_ROW_BASE:
+        df["row"] += INGESTED_ROW_BASE
+
+    return df.set_index("row").rename_axis(None)
+
+
+def get_matches(name, keys):
+    """
+    Returns the rows of a table for every (match_id, series) in keys as one frame,
+    with match_id and series as regular columns and the row id as the index.
+    Ingested matches are read from their partitions, the rest
+    are found with a binary search on the sorted index of the table and
+    taken out of it together, instead of concatenating one match at a time.
+    """
+    keys = [(match_id, int(series)) for match_id, series in keys]
+    manifest = read_manifest(name)
+
+    frames = []
+    rest = []
+    for match_id, series in keys:
+        partition = manifest["partitions"].get(partition_key(match_id, series))
+        if partition is not None:
+            frames.append(_partition_frame(name, manifest, partition))
+        else:
+            rest.append((match_id, series))
+
+    if rest != [] and has_table(name):
+        df = load_table(name)
+        positions = [np.arange(*df.index.slice_locs(key, key)) for key in rest]
+        dff = df.iloc[np.concatenate(positions)]
+        frames.append(dff.reset_index(level=INDEX_COLS).rename_axis(None))
+
+    if frames == []:
+        return pd.DataFrame()
+
+    frames = encode_frames(frames)
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+
+def get_pool(keys):
+    """
+    Returns (kills, rounds, damage) for the (match_id, series) in keys,
+    with their categorical columns on the same dictionaries.
+    """
+    keys = list(keys)
+
+    # one pass over the shared dictionaries so all three agree on the codes
+    return tuple(
+        encode_frames([get_matches(name, keys) for name in ["kills", "game_round", "damage"]])
+    )
+
+
+if __name__ == "__main__":
+    for name in TABLES:
+        if has_table(name):
+            convert_table(name)
+            print("converted " + name)
@@ -0,0 +1,80 @@
+"""
+This is the connection setup for the Postgres backend.
+Every worker keeps one engine per database (and one for the read replica),
+created the first time it's asked for, so callbacks borrow pooled
+connections instead of connecting on every click. Currently there's
+VIS_DATABASE - the database the saved visualizations live in
+database_url - function to build the url of a database from the DB_* variables
+get_engine - function to get the (pooled) engine of a database
+read_engine - function to get the engine for the heavy HLTV_KILL/HLTV_DAMAGE reads
+
+Pool settings come from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and
+DB_POOL_RECYCLE (seconds). Reads go to DB_REPLICA_HOST when it's set.
+"""
+import os
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import QueuePool
+
+VIS_DATABASE = "eg_gaming_dev"
+
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+# recycle before the server (or a proxy in between) drops idle connections
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+# (pid, database, replica) -> engine
+_engines = {}
+_lock = threading.Lock()
+
+
+def database_url(database=None, replica=False):
+    """
+    Returns the url of database (DB_NAME by default), on the read replica
+    if replica is True and DB_REPLICA_HOST is set.
+    """
+    host = os.environ["DB_HOST"]
+    if replica:
+        host = os.environ.get("DB_REPLICA_HOST", host)
+
+    return URL.create(
+        "postgresql+psycopg2",
+        host=host,
+        database=database or os.environ["DB_NAME"],
+        port=os.environ["DB_PORT"],
+        username=os.environ["DB_USER"],
+        password=os.environ["DB_PASSWORD"],
+    )
+
+
+def get_engine(database=None, replica=False):
+    """
+    Returns this worker's engine for database (DB_NAME by default).
+    Engines are keyed by pid too, so a worker forked after an engine was
+    made never shares its parent's connections.
+    """
+    key = (os.getpid(), database, replica and "DB_REPLICA_HOST" in os.environ)
+    if key not in _engines:
+        with _lock:
+            if key not in _engines:
+                _engines[key] = create_engine(
+                    database_url(database, replica),
+                    poolclass=QueuePool,
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_timeout=POOL_TIMEOUT,
+                    pool_recycle=POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+
+    return _engines[key]
+
+
+def read_engine(database=None):
+    """
+    Returns the engine for the heavy reads (HLTV_KILL, HLTV_DAMAGE, ...),
+    the read replica if there's one, otherwise the primary.
+    """
+    return get_engine(database, replica=True)
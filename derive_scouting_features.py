@@ -49,40 +49,306 @@ def kill_does_not_matter(x, bomb_event, frame_player):
     else:
         return 0
     
+def same_match(x, df):
+    """
+    Returns a mask of the rows of df in the same match as the row x,
+    on the match columns (match_id, series) both of them have.
+    """
+    mask = pd.Series(True, index=df.index)
+    for col in ["match_id", "series"]:
+        if col in x.index and col in df:
+            mask &= (df[col] == x[col]).values
+
+    return mask
+
+
 def damage_done_before_death(x, damage):
     """
     This function computes the damage done approximately 3 sec before a death,
-    where x is a row in a kill table."""
-    dmg = damage.loc[(damage.attacker_name == x.victim_name) & 
+    where x is a row in a kill table. Only damage from the kill's match counts."""
+    in_window = (same_match(x, damage) &
+          (damage.attacker_name == x.victim_name) &
           (damage.tick < x.tick + 128 * 3) &
-          (damage.tick > x.tick - 128 * 3)].hp_damage_taken.sum() + damage.loc[(damage.attacker_name == x.victim_name) & 
-          (damage.tick < x.tick + 128 * 3) &
-          (damage.tick > x.tick - 128 * 3)].armor_damage_taken.sum()
+          (damage.tick > x.tick - 128 * 3))
+    dmg = damage.loc[in_window].hp_damage_taken.sum() + damage.loc[in_window].armor_damage_taken.sum()
     
     return dmg
 
 def damage_taken(x, damage):
     """
     This function computes the damage done approximately 3 sec before a death,
-    where x is a row in a kill table."""
-    dmg = damage.loc[(damage.victim_name == x.victim_name) & 
-          (damage.tick < x.tick + 128 * 3) &
-          (damage.tick > x.tick - 128 * 3)].hp_damage_taken.sum() + damage.loc[(damage.victim_name == x.victim_name) & 
+    where x is a row in a kill table. Only damage from the kill's match counts."""
+    in_window = (same_match(x, damage) &
+          (damage.victim_name == x.victim_name) &
           (damage.tick < x.tick + 128 * 3) &
-          (damage.tick > x.tick - 128 * 3)].armor_damage_taken.sum()
+          (damage.tick > x.tick - 128 * 3))
+    dmg = damage.loc[in_window].hp_damage_taken.sum() + damage.loc[in_window].armor_damage_taken.sum()
     
     return dmg
-    
 
-def add_kill_features(kill, bomb_event, frame_player, damage):
-    """This function adds the following three features
-    to the kill dataframe, using the bomb_event and frame_player
-    data from the same match:
+
+def damage_in_window(kill, damage, damage_col, window=128 * 3):
+    """
+    Vectorized version of damage_done_before_death and damage_taken.
+    For every kill, this sums the hp and armor damage of the rows in damage
+    where damage_col (i.e. 'attacker_name') is the kill's victim and the tick
+    is strictly within *window* ticks of the kill, in the same match if the
+    tables have match_id/series.
+    Damage is sorted by (player, tick) once and the sums come from a cumulative sum,
+    so the cost is a sort plus two binary searches per kill.
+    """
+    if kill.empty or damage.empty:
+        return np.zeros(len(kill), dtype=np.int64)
+
+    # players are told apart per match, when both tables have the match columns
+    keys = match_keys(kill, damage)
+    damage_players = pd.MultiIndex.from_arrays(
+        [damage[col] for col in keys] + [damage[damage_col].astype(object)]
+    )
+    kill_players = pd.MultiIndex.from_arrays(
+        [kill[col] for col in keys] + [kill.victim_name.astype(object)]
+    )
+    players = damage_players[damage[damage_col].notna().values].unique()
+    damage_codes = players.get_indexer(damage_players)
+    kill_codes = players.get_indexer(kill_players)
+
+    known = damage_codes >= 0
+    damage_codes = damage_codes[known]
+    damage_ticks = damage.tick.values[known].astype(np.int64)
+    total = (
+        damage.hp_damage_taken.fillna(0).values[known]
+        + damage.armor_damage_taken.fillna(0).values[known]
+    )
+
+    # one sortable key per (player, tick), wide enough that windows never spill into the next player
+    tick_min, tick_max = damage_ticks.min(), damage_ticks.max()
+    span = tick_max - tick_min + 4 * window + 1
+
+    def key(codes, ticks):
+        return codes * span + (ticks - tick_min + 2 * window)
+
+    order = np.lexsort((damage_ticks, damage_codes))
+    keys = key(damage_codes[order], damage_ticks[order])
+    cumulative = np.concatenate([[0], np.cumsum(total[order])])
+
+    # ticks further than a window from any damage have an empty window either way
+    ticks = np.clip(kill.tick.values.astype(np.int64), tick_min - window, tick_max + window)
+    lo = np.searchsorted(keys, key(kill_codes, ticks - window), side="right")
+    hi = np.searchsorted(keys, key(kill_codes, ticks + window), side="left")
+
+    return np.where(kill_codes >= 0, cumulative[hi] - cumulative[lo], 0)
+
+
+def add_damage_features(kill, damage, vectorized=True):
+    """
+    This function adds the following two features
+    to the kill dataframe, using the damage data
+    of the same matches:
+    damage_done_before_death (damage the victim did ~3 sec around their death)
+    damage_taken (damage the victim took ~3 sec around their death)
+    vectorized=False falls back to the row-wise functions above.
+    """
+    if vectorized:
+        kill["damage_done_before_death"] = damage_in_window(kill, damage, "attacker_name")
+        kill["damage_taken"] = damage_in_window(kill, damage, "victim_name")
+    else:
+        kill["damage_done_before_death"] = kill.apply(lambda x: damage_done_before_death(x, damage), axis=1)
+        kill["damage_taken"] = kill.apply(lambda x: damage_taken(x, damage), axis=1)
+
+
+def build_round_index(round_df):
+    """
+    This function builds an index of the rounds in round_df, sorted by
+    (match_id, series, start_tick), so the round of a whole array of
+    kill ticks can be looked up at once with lookup_rounds.
+    """
+    matches = pd.MultiIndex.from_arrays([round_df.match_id, round_df.series])
+    codes, uniques = pd.factorize(matches)
+    start_ticks = round_df.start_tick.values.astype(np.int64)
+    # start ticks can be slightly negative, keys are offset from the smallest one
+    tick_min = start_ticks.min() if len(start_ticks) else 0
+    tick_max = start_ticks.max() if len(start_ticks) else 0
+    span = tick_max - tick_min + 3
+
+    order = np.lexsort((start_ticks, codes))
+
+    return {
+        "matches": pd.MultiIndex.from_tuples(uniques, names=["match_id", "series"]),
+        "tick_min": tick_min,
+        "span": span,
+        "keys": codes[order] * span + (start_ticks[order] - tick_min + 1),
+        "codes": codes[order],
+        "rows": order,
+    }
+
+
+def lookup_rounds(round_index, match_ids, series, ticks, inclusive=False):
+    """
+    Returns, for every (match_id, series, tick), the position in round_df
+    of the last round of that match starting before the tick
+    (at or before it if inclusive), or -1 if there is none.
+    """
+    codes = round_index["matches"].get_indexer(pd.MultiIndex.from_arrays([match_ids, series]))
+    tick_min, span = round_index["tick_min"], round_index["span"]
+    ticks = np.clip(np.asarray(ticks, dtype=np.int64), tick_min - 1, tick_min + span - 2)
+
+    i = np.searchsorted(
+        round_index["keys"],
+        codes * span + (ticks - tick_min + 1),
+        side="right" if inclusive else "left",
+    ) - 1
+    found = (codes >= 0) & (i >= 0)
+    found[found] = round_index["codes"][i[found]] == codes[found]
+
+    return np.where(found, round_index["rows"][np.maximum(i, 0)], -1)
+
+
+def add_round_features(kill, round_df, round_index=None):
+    """
+    This function adds the following three features
+    to the kill dataframe, using the round data
+    of the same matches:
+    true_round_time (seconds since the start of the round)
+    t_round_type (buy type of T side that round)
+    ct_round_type (buy type of CT side that round)
+    """
+    if round_index is None:
+        round_index = build_round_index(round_df)
+
+    rows = lookup_rounds(round_index, kill.match_id, kill.series, kill.tick)
+    start_ticks = np.where(rows >= 0, round_df.start_tick.values[rows], np.nan)
+    kill["true_round_time"] = np.round((kill.tick.values - start_ticks) / 128, 1)
+
+    rows = lookup_rounds(round_index, kill.match_id, kill.series, kill.tick, inclusive=True)
+    for col, buy_col in [("t_round_type", "t_buy_type"), ("ct_round_type", "ct_buy_type")]:
+        kill[col] = round_df[buy_col].iloc[np.maximum(rows, 0)].where(rows >= 0).values
+
+
+def match_keys(*dfs):
+    """
+    Returns the match columns (match_id, series) all of dfs have,
+    so the batched features never mix up players across matches.
+    """
+    return [col for col in ["match_id", "series"] if all(col in df for df in dfs)]
+
+
+def asof_player(kill, frame_player, player_col, cols, allow_exact_matches=True):
+    """
+    For every kill, this finds the last frame_player row of the player in
+    player_col (i.e. 'victim_name') at or before the kill tick (strictly before
+    if not allow_exact_matches) with one merge_asof, and returns its *cols*
+    in the order of kill.
+    """
+    keys = match_keys(kill, frame_player)
+    left = kill[keys + [player_col, "tick"]].rename(columns={player_col: "name"})
+    left = left.astype({col: object for col in keys + ["name"]})
+    left["position"] = np.arange(len(left))
+    right = frame_player[keys + ["name", "tick"] + cols]
+    right = right.astype({col: object for col in keys + ["name"]})
+
+    dff = pd.merge_asof(
+        left.sort_values("tick", kind="stable"),
+        right.dropna(subset=keys + ["name", "tick"]).sort_values("tick", kind="stable"),
+        on="tick",
+        by=keys + ["name"],
+        allow_exact_matches=allow_exact_matches,
+    )
+
+    return dff.sort_values("position")[cols].reset_index(drop=True)
+
+
+def hp_plateaus(frame_player, threshold=5):
+    """
+    Vectorized find_plateau. For every frame of every player this gives the hp of the
+    latest plateau (threshold+1 equal non-zero hp values in a row) ending at or before
+    that frame, in one pass over frame_player sorted by (player, tick).
+    Returns the sorted frames with the plateau hp in a 'plateau_hp' column.
+    """
+    keys = match_keys(frame_player) + ["name"]
+    df = frame_player.sort_values(keys + ["tick"], kind="stable")
+    player = df.groupby(keys, sort=False, observed=True).ngroup().values
+    hp = df.hp.values
+
+    same_player = np.concatenate([[False], player[1:] == player[:-1]])
+    equal = same_player & np.concatenate([[False], hp[1:] == hp[:-1]]) & (hp != 0)
+    # length of the run of equal pairs ending at each frame
+    count = np.cumsum(equal)
+    run = count - np.maximum.accumulate(np.where(equal, 0, count))
+
+    plateau = pd.Series(np.where(run >= threshold, hp, np.nan), index=df.index)
+
+    return df.assign(plateau_hp=plateau.groupby(player).ffill().values)
+
+
+def plant_table(bomb_event, frame_player):
+    """
+    Returns one row per round with a plant: the planted site ('BombsiteA'),
+    the plant tick and the last frame tick of the round.
+    """
+    keys = match_keys(bomb_event, frame_player) + ["round_num"]
+    plants = bomb_event.loc[bomb_event.bomb_action == "plant"]
+    plants = plants.drop_duplicates(keys)[keys + ["bomb_site", "tick"]]
+    plants = plants.astype({"bomb_site": object}).rename(columns={"tick": "plant_tick"})
+    plants["bombsite"] = "Bombsite" + plants.bomb_site
+
+    last_ticks = frame_player.groupby(keys, observed=True).tick.max().rename("last_tick")
+
+    return plants.merge(last_ticks.reset_index(), on=keys, how="left")
+
+
+def kills_that_do_not_matter(kill, bomb_event, frame_player):
+    """
+    Vectorized kill_does_not_matter, with one join of the kills to the plant table.
+    """
+    keys = match_keys(kill, bomb_event, frame_player) + ["round_num"]
+    plants = plant_table(bomb_event, frame_player)
+    dff = kill[keys + ["tick", "attacker_area_name", "victim_area_name"]].merge(
+        plants.astype({col: kill[col].dtype for col in keys}), on=keys, how="left"
+    )
+
+    does_not_matter = (
+        (dff.plant_tick <= dff.tick)
+        & (dff.tick <= dff.last_tick)
+        & (dff.attacker_area_name.astype(object) != dff.bombsite)
+        & (dff.victim_area_name.astype(object) != dff.bombsite)
+    )
+
+    return np.where(does_not_matter, 1, 0)
+
+
+def add_kill_features(kill, bomb_event, frame_player, damage, vectorized=True):
+    """This function adds the following features
+    to the kill dataframe, using the bomb_event, frame_player
+    and damage data from the same matches:
     victim_equipment_value
     victim_hp
     high_health_kill (1 if victim had > 75 hp)
     kill_does_not_matter (1 if kill occurs after plant,
-        and away from bombsite)"""
+        and away from bombsite)
+    damage_done_before_death
+    Each step runs once for all the kills, vectorized=False falls back
+    to the original row-wise version."""
+    if not vectorized:
+        return add_kill_features_rowwise(kill, bomb_event, frame_player, damage)
+
+    kill['victim_equipment_value'] = asof_player(
+        kill, frame_player, 'victim_name', ['equipment_value_freezetime_end']
+    ).equipment_value_freezetime_end.values
+
+    kill['victim_hp'] = asof_player(
+        kill, hp_plateaus(frame_player), 'victim_name', ['plateau_hp'], allow_exact_matches=False
+    ).plateau_hp.values
+
+    kill['high_health_kill'] = np.where(kill.victim_hp > 75 , 1 , 0)
+
+    kill['kill_does_not_matter'] = kills_that_do_not_matter(kill, bomb_event, frame_player)
+
+    kill['damage_done_before_death'] = damage_in_window(kill, damage, 'attacker_name')
+
+
+def add_kill_features_rowwise(kill, bomb_event, frame_player, damage):
+    """Row-wise version of add_kill_features, one frame_player scan per kill.
+    Note this takes the equipment value of the attacker, not the victim."""
     # Make DF with kill value in each column
     kills_renamed = kill.rename(columns = {'attacker_name' : 'name'})
     kills_renamed['tick'] = [round_down_in_list(x, list(frame_player.tick)) for x in list(kill.tick)]
@@ -0,0 +1,220 @@
+"""
+This is the feature materialization stage for the kill table. The derived
+features of a kill only depend on its own match, so they're computed once
+per match and kept in a sidecar file per match,
+data/kill_features/match=<match_id>/series=<series>.parquet, keyed by the
+kill's row id. data/kill_features/manifest.json records the
+FEATURE_VERSION each match was computed with and the versions of the
+kill, round and damage rows it was computed from. Bumping FEATURE_VERSION
+(whenever a formula changes) makes every match stale, so does a change
+to one of its source files, and stale or missing matches are backfilled
+the next time they're asked for. Workers update the
+manifest one at a time, under an exclusive lock on manifest.lock.
+Currently there's
+FEATURE_VERSION - version of the feature formulas, bump it when one changes
+FEATURE_COLS - the materialized columns (DAMAGE_FEATURES + ROUND_FEATURES)
+compute_features - function to compute the features of a set of kills
+materialize_features - function to compute and store the features of stale matches
+pool_features - function to read the features of a match pool, backfilling if needed
+
+Run this file to backfill every match in data/.
+"""
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from data_store import (
+    DATA_DIR,
+    encode_frames,
+    get_pool,
+    match_versions,
+    partition_key,
+    table_matches,
+)
+from derive_scouting_features import add_damage_features, add_round_features
+from filter_engine import victim_side
+
+FEATURE_VERSION = 2
+
+# features from the damage table, and from the round table (plus the victim's side)
+DAMAGE_FEATURES = ["damage_done_before_death", "damage_taken", "net_dmg"]
+ROUND_FEATURES = ["true_round_time", "t_round_type", "ct_round_type", "victim_side"]
+FEATURE_COLS = DAMAGE_FEATURES + ROUND_FEATURES
+
+FEATURE_DIR = os.path.join(DATA_DIR, "kill_features")
+
+# the tables the features are computed from
+SOURCE_TABLES = ["kills", "game_round", "damage"]
+
+_lock = threading.Lock()
+
+
+def feature_manifest_path():
+    return os.path.join(FEATURE_DIR, "manifest.json")
+
+
+@contextmanager
+def manifest_lock():
+    """
+    Holds the manifest for this thread and, through an exclusive lock on
+    manifest.lock, for this process, so no other worker reads or writes it meanwhile.
+    """
+    with _lock:
+        os.makedirs(FEATURE_DIR, exist_ok=True)
+        with open(os.path.join(FEATURE_DIR, "manifest.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_feature_manifest():
+    """
+    Returns {"match_id/series": {"version", "sources", "path"}} for every
+    materialized match, sources being the match_versions of its SOURCE_TABLES.
+    """
+    try:
+        with open(feature_manifest_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_feature_manifest(manifest):
+    os.makedirs(FEATURE_DIR, exist_ok=True)
+    tmp = feature_manifest_path() + "." + str(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, feature_manifest_path())
+
+
+def compute_features(kill, round_df, damage):
+    """
+    Returns the FEATURE_COLS of every kill in kill (same index), computed from the
+    rounds and damage of the same matches with derive_scouting_features.
+    """
+    dff = kill.copy()
+    add_damage_features(dff, damage)
+    dff["net_dmg"] = dff["damage_done_before_death"] - dff["damage_taken"]
+    add_round_features(dff, round_df)
+    dff["victim_side"] = victim_side(dff)
+
+    return dff[FEATURE_COLS]
+
+
+def source_versions(keys):
+    """
+    Returns {"match_id/series": {table: version}} of the SOURCE_TABLES of every match in keys.
+    """
+    versions = {name: match_versions(name, keys) for name in SOURCE_TABLES}
+
+    return {
+        partition_key(match_id, series): {
+            name: versions[name][partition_key(match_id, series)] for name in SOURCE_TABLES
+        }
+        for match_id, series in keys
+    }
+
+
+def materialize_features(keys, force=False):
+    """
+    Computes the features of the matches in keys that were never materialized,
+    or were with an older FEATURE_VERSION or from since changed rows (all of
+    them if force), in one batch, and writes one sidecar file per match.
+    Returns the number of matches (re)computed.
+    """
+    keys = list(dict.fromkeys((match_id, int(series)) for match_id, series in keys))
+    with manifest_lock():
+        manifest = read_feature_manifest()
+        sources = source_versions(keys)
+        stale = [
+            (match_id, series)
+            for match_id, series in keys
+            if force
+            or manifest.get(partition_key(match_id, series), {}).get("version")
+            != FEATURE_VERSION
+            or manifest[partition_key(match_id, series)].get("sources")
+            != sources[partition_key(match_id, series)]
+        ]
+        if stale == []:
+            return 0
+
+        kill_df, round_df, damage_df = get_pool(stale)
+        features = pd.DataFrame(columns=FEATURE_COLS)
+        if not kill_df.empty and not round_df.empty:
+            features = compute_features(kill_df, round_df, damage_df)
+            features.index.name = "row"
+
+        for match_id, series in stale:
+            path = os.path.join(
+                "match=" + str(match_id), "series=" + str(series) + ".parquet"
+            )
+            full_path = os.path.join(FEATURE_DIR, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if not features.empty:
+                rows = (kill_df.match_id == match_id) & (kill_df.series == series)
+                dff = features.loc[rows.values]
+            else:
+                dff = features
+            dff.reset_index().to_parquet(full_path + ".tmp", index=False)
+            os.replace(full_path + ".tmp", full_path)
+            manifest[partition_key(match_id, series)] = {
+                "version": FEATURE_VERSION,
+                "sources": sources[partition_key(match_id, series)],
+                "path": path,
+            }
+
+        write_feature_manifest(manifest)
+
+    return len(stale)
+
+
+def read_features(keys):
+    manifest = read_feature_manifest()
+    frames = [
+        pd.read_parquet(
+            os.path.join(FEATURE_DIR, manifest[partition_key(match_id, series)]["path"])
+        )
+        for match_id, series in dict.fromkeys(keys)
+    ]
+    frames = [df for df in frames if not df.empty]
+    if frames == []:
+        return pd.DataFrame(columns=FEATURE_COLS)
+
+    features = pd.concat(frames).set_index("row").rename_axis(None)
+
+    return encode_frames([features])[0]
+
+
+def pool_features(keys, rows=None):
+    """
+    Returns the FEATURE_COLS of the kills of every (match_id, series) in keys,
+    indexed by the kills' row id, backfilling stale matches first.
+    If the row ids of the pool's kills are given and some have no features
+    (the kill table changed since), the pool is recomputed.
+    The row ids are the ones of the local data store (see data_store.get_pool),
+    kills from anywhere else need compute_features instead.
+    """
+    keys = [(match_id, int(series)) for match_id, series in keys]
+    materialize_features(keys)
+    features = read_features(keys)
+
+    if rows is not None and not pd.Index(rows).isin(features.index).all():
+        materialize_features(keys, force=True)
+        features = read_features(keys)
+
+    return features
+
+
+def all_matches():
+    """
+    Returns every (match_id, series) in the kill table, ingested or not.
+    """
+    return table_matches("kills")
+
+
+if __name__ == "__main__":
+    print("computed the features of " + str(materialize_features(all_matches())) + " matches")
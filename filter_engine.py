@@ -0,0 +1,251 @@
+"""
+This is the engine behind the filter_table callback.
+Every filter (time, net dmg, rounds, buy type, weapons, sides)
+is a boolean mask over the kill table. The masks are cached per
+kill table and filter setting, so when one control changes only
+its mask is recomputed, and the filtered views are the AND of the masks.
+Currently there's
+cached_mask - function to get (or compute once) the mask of one filter
+in_values - function to check which values of a column are allowed, on categorical codes
+compile_rounds - function to compile a round selector expression to a boolean array
+victim_side - function to find the side of the victim of each kill
+filter_kills - function to apply all filters and return the victim and attacker views
+weapon_options - function to get the weapon filter options of every team and player
+"""
+import re
+import json
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+MAX_MASKS = 1024
+
+# rounds past this (deep overtime) share the last slot of a round mask
+MAX_ROUND = 99
+
+# (table key, filter name, settings) -> mask (or victim sides), least recently used first
+_masks = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cached(table_key, name, settings, compute):
+    key = (table_key, name, json.dumps(settings, sort_keys=True, default=str))
+    with _lock:
+        if key in _masks:
+            _masks.move_to_end(key)
+            return _masks[key]
+
+    values = compute()
+
+    with _lock:
+        _masks[key] = values
+        while len(_masks) > MAX_MASKS:
+            _masks.popitem(last=False)
+
+    return values
+
+
+def cached_mask(table_key, name, settings, compute):
+    """
+    Returns the mask of filter *name* with *settings* on the kill table
+    stored under table_key, calling compute() only if it's not cached.
+    """
+    return _cached(
+        table_key, name, settings, lambda: np.asarray(compute(), dtype=bool)
+    )
+
+
+@lru_cache(maxsize=256)
+def compile_rounds(expression, max_round=MAX_ROUND):
+    """
+    Compiles a round selector expression to a read-only boolean array of
+    max_round + 1 values, where mask[round_num] tells if the round is selected
+    and the last slot stands for every round from max_round on.
+    Rounds are numbered from 1. Items are separated by commas or spaces,
+    each is a round ("16"), a range ("1-5", both ends included), or an
+    open-ended range ("20-" is round 20 and everything after, overtime
+    included, "-5" is rounds 1 to 5). Anything else is ignored, and an
+    empty expression selects every round.
+
+    >>> np.flatnonzero(compile_rounds("1-5, 16", 40))
+    array([ 1,  2,  3,  4,  5, 16])
+    >>> np.flatnonzero(compile_rounds("28 30-", 40))[:4]
+    array([28, 30, 31, 32])
+    >>> bool(compile_rounds("30-", 40)[40]), bool(compile_rounds("30-35", 40)[40])
+    (True, False)
+    >>> np.flatnonzero(compile_rounds("-3, 5-4", 40))
+    array([1, 2, 3, 4, 5])
+    >>> int(compile_rounds("", 40).sum()), int(compile_rounds("abc", 40).sum())
+    (40, 0)
+    """
+    mask = np.zeros(max_round + 1, dtype=bool)
+    if expression is None or expression.strip() == "":
+        mask[1:] = True
+    else:
+        # (start, end, round) of every range or single round
+        items = re.findall(r"(\d+)?\s*-\s*(\d+)?|(\d+)", expression)
+        for start, end, single in items:
+            if single != "":
+                bounds = [int(single)] * 2
+            elif start == "" and end == "":
+                continue
+            else:
+                bounds = [int(start) if start else 1, int(end) if end else max_round]
+            lo, hi = sorted(min(x, max_round) for x in bounds)
+            mask[lo : hi + 1] = True
+
+    mask[0] = False
+    mask.flags.writeable = False
+
+    return mask
+
+
+def round_mask(df, expression):
+    """
+    Returns which kills of df are in the rounds of a round selector expression,
+    with one lookup in its compiled mask.
+    """
+    mask = compile_rounds(expression or "")
+    return mask[np.clip(df.round_num.values.astype(np.int64), 0, len(mask) - 1)]
+
+
+def in_values(values, allowed):
+    """
+    Returns values.isin(allowed) as an array. For categoricals this
+    compares the integer codes, looking up allowed in the categories once.
+    """
+    allowed = list(allowed)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.categories.get_indexer(allowed)
+        return np.isin(values.cat.codes.values, codes[codes >= 0])
+
+    return values.isin(allowed).values
+
+
+def victim_side(df):
+    """
+    Victims are on the other side of the attacker, unless it's a teamkill.
+    """
+    attacker_side = df.attacker_side.astype(object).values
+    return np.where(
+        df.is_teamkill.values.astype(bool),
+        attacker_side,
+        np.where(attacker_side == "T", "CT", "T"),
+    )
+
+
+def filter_kills(
+    table_key,
+    df,
+    time,
+    net_dmg,
+    rounds,
+    t_buy_types,
+    ct_buy_types,
+    player_weapons,
+    team_weapons,
+    all_weapons,
+    player_sides,
+):
+    """
+    Applies the filters to the kill table df (stored under table_key)
+    and returns [df_victim, df_attacker], both with a victim_side column.
+    rounds is a round selector expression (see compile_rounds),
+    player_weapons and team_weapons are dicts of name -> allowed weapons (or None),
+    player_sides is a list of (player, allowed sides).
+    The side filters only apply to the victim/attacker view respectively.
+    """
+    if df.empty:
+        return [pd.DataFrame(), pd.DataFrame()]
+
+    def mask(name, settings, compute):
+        return cached_mask(table_key, name, settings, compute)
+
+    if "victim_side" in df:
+        # materialized with the other kill features
+        victim_sides = df.victim_side
+    else:
+        victim_sides = pd.Series(
+            _cached(table_key, "victim_sides", None, lambda: victim_side(df)),
+            index=df.index,
+        )
+
+    keep = mask(
+        "time",
+        time,
+        lambda: (df.true_round_time > time[0]) & (df.true_round_time < time[1]),
+    )
+    keep = keep & mask(
+        "net_dmg",
+        net_dmg,
+        lambda: (df.net_dmg > net_dmg[0]) & (df.net_dmg < net_dmg[1]),
+    )
+    keep = keep & mask("rounds", rounds, lambda: round_mask(df, rounds))
+    if t_buy_types != []:
+        keep = keep & mask(
+            "t_buy", t_buy_types, lambda: in_values(df.t_round_type, t_buy_types)
+        )
+    if ct_buy_types != []:
+        keep = keep & mask(
+            "ct_buy", ct_buy_types, lambda: in_values(df.ct_round_type, ct_buy_types)
+        )
+
+    for player, weapons in player_weapons.items():
+        if weapons is not None:
+            keep = keep & mask(
+                "player_weapon",
+                [player, weapons],
+                lambda: ~(in_values(df.attacker_name, [player]) & ~in_values(df.weapon, weapons)),
+            )
+    for team, weapons in team_weapons.items():
+        if weapons is not None:
+            keep = keep & mask(
+                "team_weapon",
+                [team, weapons],
+                lambda: ~(in_values(df.attacker_team, [team]) & ~in_values(df.weapon, weapons)),
+            )
+    if all_weapons is not None:
+        keep = keep & mask("all_weapon", all_weapons, lambda: in_values(df.weapon, all_weapons))
+
+    keep_victim = keep.copy()
+    keep_attacker = keep.copy()
+    for player, side in player_sides:
+        keep_victim &= mask(
+            "victim_side",
+            [player, side],
+            lambda: ~(in_values(df.victim_name, [player]) & ~in_values(victim_sides, side)),
+        )
+        keep_attacker &= mask(
+            "attacker_side",
+            [player, side],
+            lambda: ~(in_values(df.attacker_name, [player]) & ~in_values(df.attacker_side, side)),
+        )
+
+    return [
+        df.loc[keep_victim].assign(victim_side=victim_sides.values[keep_victim]),
+        df.loc[keep_attacker].assign(victim_side=victim_sides.values[keep_attacker]),
+    ]
+
+
+def weapon_options(df):
+    """
+    Returns {team: {"team", "weapons", "players": [[player, weapons], ...]}} for
+    the attackers in the kill table df, with one groupby over the distinct
+    (team, player, weapon) rows. Players keep the order they first show up in.
+    """
+    pairs = df[["attacker_team", "attacker_name", "weapon"]].drop_duplicates()
+    players = pairs.groupby(
+        ["attacker_team", "attacker_name"], sort=False, observed=True
+    ).weapon.agg(lambda x: sorted(x.astype(object)))
+
+    options = {}
+    for (team, player), weapons in players.items():
+        option = options.setdefault(team, {"team": team, "weapons": set(), "players": []})
+        option["weapons"].update(weapons)
+        option["players"].append([player, weapons])
+    for option in options.values():
+        option["weapons"] = sorted(option["weapons"])
+
+    return options
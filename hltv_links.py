@@ -0,0 +1,198 @@
+"""
+This is the resolver behind the "HLTV link" graph tool. It finds the
+HLTV page of a match from its source_match_filename by searching for it,
+on a small pool of background threads with retries, and keeps every
+link it finds in a local key-value cache (an SQLite file), so each match
+is only ever looked up once. Lookups that found nothing are cached too
+(without a url) and only tried again after MISS_TTL. Callbacks only read
+the cache and queue the misses, they never wait on the network.
+Currently there's
+find_link - function to look up the HLTV link of one match (blocking)
+cached_link - function to get a link from the cache, queueing a lookup if it's not there
+prefetch_links - function to queue lookups for many matches at once
+run_stub - function to serve a fake search page locally, to stand in for the search site
+
+The search site is SEARCH_URL (env HLTV_SEARCH_URL), point it at run_stub to test offline.
+Run this file with a list of filenames to resolve them ahead of time,
+or with --stub [port] to start the stub.
+"""
+import os
+import sys
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+from bs4 import BeautifulSoup
+
+SEARCH_URL = os.environ.get("HLTV_SEARCH_URL", "https://www.google.com/search")
+CACHE_PATH = os.environ.get(
+    "HLTV_LINK_CACHE", os.path.join("data", ".cache", "hltv_links.db")
+)
+MAX_WORKERS = int(os.environ.get("HLTV_LOOKUP_WORKERS", 4))
+RETRIES = 3
+# seconds before a lookup that found nothing is tried again
+MISS_TTL = float(os.environ.get("HLTV_MISS_TTL_HOURS", 24)) * 3600
+TIMEOUT = 10
+
+HEADERS = {
+    "Accept": "*/*",
+    "Accept-Language": "en-US,en;q=0.5",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82",
+}
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="hltv")
+# filenames being looked up right now
+_pending = set()
+_lock = threading.Lock()
+
+
+def _connect():
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS links (filename TEXT PRIMARY KEY, url TEXT, resolved_at REAL)"
+    )
+    return conn
+
+
+def _read(filenames):
+    """
+    Returns {filename: (url, resolved_at)} for the cached filenames,
+    url is None if the lookup found nothing.
+    """
+    conn = _connect()
+    try:
+        placeholders = ",".join("?" * len(filenames))
+        rows = conn.execute(
+            "SELECT filename, url, resolved_at FROM links WHERE filename IN ("
+            + placeholders
+            + ")",
+            list(filenames),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return {filename: (url, resolved_at) for filename, url, resolved_at in rows}
+
+
+def _write(filename, url):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO links VALUES (?, ?, ?)",
+                (filename, url, time.time()),
+            )
+    finally:
+        conn.close()
+
+
+def find_link(filename, session=None):
+    """
+    Searches for the HLTV page of a match and returns the first result,
+    trying RETRIES times with a growing pause. Returns None if nothing was found.
+    """
+    session = session or requests
+    parameters = {"q": "hltv " + str(filename)}
+
+    for attempt in range(RETRIES):
+        try:
+            response = session.get(
+                SEARCH_URL, headers=HEADERS, params=parameters, timeout=TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            time.sleep(0.5 * 2**attempt)
+            continue
+
+        soup = BeautifulSoup(response.text, "html.parser")
+        search = soup.find(id="search")
+        first_link = search.find("a") if search is not None else None
+        return first_link["href"] if first_link is not None else None
+
+    return None
+
+
+def _resolve(filename):
+    try:
+        # remember misses too, so they aren't searched again until MISS_TTL
+        _write(filename, find_link(filename))
+    finally:
+        with _lock:
+            _pending.discard(filename)
+
+
+def prefetch_links(filenames):
+    """
+    Queues a lookup for every filename that's not cached (or was a miss more
+    than MISS_TTL ago) or already queued.
+    Returns the links that are already cached, as a dictionary.
+    """
+    filenames = {x for x in filenames if x}
+    if not filenames:
+        return {}
+
+    cached = _read(filenames)
+    links = {filename: url for filename, (url, _) in cached.items() if url is not None}
+    now = time.time()
+    known = {
+        filename
+        for filename, (url, resolved_at) in cached.items()
+        if url is not None or now - resolved_at < MISS_TTL
+    }
+    with _lock:
+        missing = filenames - known - _pending
+        _pending.update(missing)
+    for filename in missing:
+        _executor.submit(_resolve, filename)
+
+    return links
+
+
+def cached_link(filename):
+    """
+    Returns the cached HLTV link of a match, or None (queueing a lookup) if
+    it's not resolved yet.
+    """
+    return prefetch_links([filename]).get(filename)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        slug = query.replace("hltv ", "").replace(" ", "-")
+        body = (
+            '<html><body><div id="search"><a href="https://www.hltv.org/matches/0/'
+            + slug
+            + '">'
+            + query
+            + "</a></div></body></html>"
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def run_stub(port=8765):
+    """
+    Serves a search page that answers every query with one fake HLTV link,
+    use it with HLTV_SEARCH_URL=http://localhost:<port>/search.
+    """
+    HTTPServer(("localhost", port), _StubHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--stub"]:
+        run_stub(*[int(x) for x in sys.argv[2:3]])
+    else:
+        for filename in sys.argv[1:]:
+            url = find_link(filename)
+            _write(filename, url)
+            print(filename, url)
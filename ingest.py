@@ -0,0 +1,168 @@
+"""
+This is the ingest tool for the parsed-demo tables. It splits a table's
+csv into one parquet file per match,
+data/<table>/map=<map_name>/match=<match_id>/series=<series>.parquet,
+and records every file in data/<table>/manifest.json. Matches that are
+already in the manifest are skipped, so ingesting a bigger csv later
+only writes the new matches and never rewrites the old files.
+The data store then reads a match pool from its own few files
+instead of the whole table.
+Currently there's
+CHUNK_ROWS - number of csv rows parsed at a time
+match_maps - function to get the map of every match, from the ingested rounds
+ingest_table - function to add the new matches in a csv to a table's partitions
+
+Run this file to ingest every table in data/, or give it table=path.csv
+pairs to ingest other files. game_round goes first since it has the
+map of each match, and the kill features (see features.py) and match
+info (see match_info.py) of new matches are materialized at the end.
+"""
+import os
+import sys
+import json
+import pandas as pd
+from features import all_matches, materialize_features
+from match_info import materialize_match_info
+from data_store import (
+    CATEGORY_COLS,
+    INDEX_COLS,
+    INGESTED_ROW_BASE,
+    TABLES,
+    has_table,
+    manifest_path,
+    partition_key,
+    partition_root,
+    read_manifest,
+    read_typed_csv,
+    table_path,
+)
+
+CHUNK_ROWS = 100000
+
+
+def match_maps():
+    """
+    Returns {"match_id/series": map_name} for every ingested match in game_round.
+    """
+    return {
+        key: partition["map_name"]
+        for key, partition in read_manifest("game_round")["partitions"].items()
+    }
+
+
+def write_manifest(name, manifest):
+    os.makedirs(partition_root(name), exist_ok=True)
+    tmp = manifest_path(name) + "." + str(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path(name))
+
+
+def write_partition(name, map_name, match_id, series, df):
+    """
+    Writes one match of a table to its parquet file, returns the path
+    relative to data/<table>/.
+    """
+    path = os.path.join(
+        "map=" + str(map_name),
+        "match=" + str(match_id),
+        "series=" + str(series) + ".parquet",
+    )
+    full_path = os.path.join(partition_root(name), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    # categories of each chunk differ, set them again for the whole match
+    df = df.astype(
+        {col: "category" for col in CATEGORY_COLS if col in df and df[col].dtype == object}
+    )
+    df.to_parquet(full_path + ".tmp", index=False)
+    os.replace(full_path + ".tmp", full_path)
+
+    return path
+
+
+def rebase_row_ids(name, manifest):
+    """
+    Moves the row ids of partitions written before INGESTED_ROW_BASE existed
+    above it, so they can't collide with the csv row numbers of matches that
+    aren't ingested. Their kill features get recomputed on the next read.
+    """
+    if manifest["next_row"] >= INGESTED_ROW_BASE:
+        return manifest
+
+    for partition in manifest["partitions"].values():
+        full_path = os.path.join(partition_root(name), partition["path"])
+        df = pd.read_parquet(full_path)
+        df["row"] += INGESTED_ROW_BASE
+        df.to_parquet(full_path + ".tmp", index=False)
+        os.replace(full_path + ".tmp", full_path)
+    manifest["next_row"] += INGESTED_ROW_BASE
+    write_manifest(name, manifest)
+
+    return manifest
+
+
+def ingest_table(name, source=None):
+    """
+    Adds the matches of source (the table's csv in data/ by default) that aren't
+    in the table's manifest yet as new partitions. Every row gets a row id,
+    unique across everything ever ingested into the table, and above the row
+    numbers of the table's csv (see INGESTED_ROW_BASE).
+    Returns the number of matches added.
+    """
+    source = source or table_path(name)
+    manifest = rebase_row_ids(name, read_manifest(name))
+    maps = match_maps()
+
+    # parse in chunks, keeping only the rows of new matches
+    pieces = {}
+    rows = 0
+    for chunk in read_typed_csv(source, chunksize=CHUNK_ROWS):
+        # the index keeps counting across chunks
+        chunk.insert(0, "row", manifest["next_row"] + chunk.index)
+        rows += len(chunk)
+        for (match_id, series), piece in chunk.groupby(INDEX_COLS, sort=False):
+            key = partition_key(match_id, series)
+            if key not in manifest["partitions"]:
+                pieces.setdefault(key, []).append(piece)
+    manifest["next_row"] += rows
+
+    for key, parts in pieces.items():
+        df = pd.concat(parts) if len(parts) > 1 else parts[0]
+        match_id, series = df.match_id.iloc[0], df.series.iloc[0]
+        if "map_name" in df:
+            map_name = df.map_name.iloc[0]
+        else:
+            map_name = maps.get(key, "unknown")
+        path = write_partition(name, map_name, match_id, series, df)
+        manifest["partitions"][key] = {
+            "map_name": str(map_name),
+            "match_id": str(match_id),
+            "series": int(series),
+            "path": path,
+            "rows": len(df),
+        }
+
+    write_manifest(name, manifest)
+
+    return len(pieces)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sources = dict(arg.split("=", 1) for arg in sys.argv[1:])
+    else:
+        sources = {name: table_path(name) for name in TABLES if has_table(name)}
+
+    for name in sorted(sources, key=lambda x: x != "game_round"):
+        print(
+            "added "
+            + str(ingest_table(name, sources[name]))
+            + " matches to "
+            + name
+        )
+    print(
+        "computed the features of "
+        + str(materialize_features(all_matches()))
+        + " matches"
+    )
+    print("added " + str(materialize_match_info()) + " matches to match_info")
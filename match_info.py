@@ -0,0 +1,378 @@
+"""
+This is the match info (summary) table behind the match table of the app:
+one row per match with winners, losers, score, T/CT round wins and rosters.
+Currently there's
+SUMMARY_COLS - the columns of the summary table
+roster_table - function to get (match_id, series, team, name) for every player of some matches
+build_match_summary - function to build the summary of a set of rounds in one pass
+match_info_table - the MATCH_INFO table the summaries are materialized into
+materialize_match_info - function to add the summary of new matches to MATCH_INFO
+query_match_info - function to read the matches on a map from MATCH_INFO
+build_match_index - function to build the date/team/player indexes of a summary
+match_table - function to get the (cached) matches on a map along with their indexes
+date_range - function to find the (contiguous) rows of the matches between two dates
+select_matches - function to find the matches in a date range with all of the given teams and players
+
+MATCH_INFO lives in Postgres when DB_HOST is set, otherwise in a local
+SQLite file. Run this file to materialize it after ingesting new data.
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Column,
+    Date,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    select,
+)
+from sqlalchemy.exc import IntegrityError
+from db import get_engine
+from data_store import (
+    DATA_DIR,
+    INDEX_COLS,
+    data_version,
+    get_matches,
+    has_table,
+    read_manifest,
+    table_matches,
+)
+
+SUMMARY_COLS = [
+    "match_id",
+    "series",
+    "match_date",
+    "winning_team",
+    "losing_team",
+    "score",
+    "winning_t_wins",
+    "winning_ct_wins",
+    "losing_t_wins",
+    "losing_ct_wins",
+    "winning_players",
+    "losing_players",
+    "map_name",
+]
+
+_lock = threading.Lock()
+
+
+def roster_source():
+    """
+    Returns the table the rosters come from, frame_player if we have it
+    (as a csv or ingested), otherwise the kill table.
+    """
+    if has_table("frame_player") or read_manifest("frame_player")["partitions"]:
+        return "frame_player"
+
+    return "kills"
+
+
+def roster_table(keys):
+    """
+    Returns (match_id, series, team, name) for every player row of the matches
+    in keys, from frame_player if we have it, otherwise from the attackers
+    in the kill table.
+    """
+    if roster_source() == "frame_player":
+        df = get_matches("frame_player", keys)
+        return df.reindex(columns=INDEX_COLS + ["team", "name"])
+
+    df = get_matches("kills", keys)
+    return df.reindex(columns=INDEX_COLS + ["attacker_team", "attacker_name"]).rename(
+        columns={"attacker_team": "team", "attacker_name": "name"}
+    )
+
+
+def data_versions():
+    """
+    Returns the versions of the round and roster tables (csv and ingested
+    partitions), which change whenever a match is added to them.
+    """
+    return (data_version("game_round"), data_version(roster_source()))
+
+
+def build_match_summary(rounds, rosters):
+    """
+    Builds the summary of every (match_id, series) in rounds with groupbys,
+    instead of filtering the rounds once per match.
+    Winners are the team with the most round wins, ties go to the first team listed.
+    """
+    keys = INDEX_COLS
+    rounds = rounds.astype(
+        {col: object for col in ["t_team", "ct_team", "winning_team", "winning_side"]}
+    )
+    if rounds.empty:
+        return pd.DataFrame(columns=SUMMARY_COLS)
+
+    matches = rounds.groupby(keys, sort=False).agg(
+        match_date=("created_at", "first"), map_name=("map_name", "first")
+    )
+    matches["match_date"] = pd.to_datetime(matches.match_date).dt.strftime("%Y-%m-%d")
+
+    # every team of every match, with its round wins per side
+    teams = pd.concat(
+        [
+            rounds[keys + ["t_team"]].rename(columns={"t_team": "team"}),
+            rounds[keys + ["ct_team"]].rename(columns={"ct_team": "team"}),
+        ]
+    ).drop_duplicates()
+    wins = (
+        rounds.groupby(keys + ["winning_team", "winning_side"])
+        .size()
+        .unstack("winning_side", fill_value=0)
+        .reindex(columns=["T", "CT"], fill_value=0)
+        .rename_axis(index=keys + ["team"], columns=None)
+        .reset_index()
+    )
+    teams = teams.merge(wins, on=keys + ["team"], how="left").fillna({"T": 0, "CT": 0})
+    teams[["T", "CT"]] = teams[["T", "CT"]].astype(int)
+    teams["wins"] = teams["T"] + teams["CT"]
+
+    # rosters as comma separated strings, names cleaned of sponsor tags
+    rosters = rosters.astype({"team": object, "name": object}).dropna()
+    rosters = rosters.drop_duplicates(keys + ["team", "name"])
+    rosters = rosters.assign(
+        name=rosters.name.str.replace("nouns.", "", regex=False).str.replace("WC", "", regex=False)
+    )
+    players = rosters.groupby(keys + ["team"], sort=False)["name"].agg(", ".join).rename("players")
+    teams = teams.merge(players, left_on=keys + ["team"], right_index=True, how="left")
+    teams["players"] = teams.players.fillna("")
+
+    teams = teams.sort_values("wins", ascending=False, kind="stable")
+    winners = teams.drop_duplicates(keys).set_index(keys)
+    losers = teams[teams.duplicated(keys)].drop_duplicates(keys).set_index(keys)
+
+    df = matches.join(winners.add_prefix("winning_"), how="inner").join(
+        losers.add_prefix("losing_"), how="inner"
+    )
+    df = df.rename(
+        columns={
+            "winning_T": "winning_t_wins",
+            "winning_CT": "winning_ct_wins",
+            "losing_T": "losing_t_wins",
+            "losing_CT": "losing_ct_wins",
+        }
+    )
+    df["score"] = df.winning_wins.astype(str) + "-" + df.losing_wins.astype(str)
+
+    return df.reset_index()[SUMMARY_COLS]
+
+
+SQLITE_PATH = os.path.join(DATA_DIR, "match_info.db")
+
+# in Postgres MATCH_INFO sits next to the other tables, in CSGO_DSA
+metadata = MetaData(
+    schema=os.environ.get("MATCH_INFO_SCHEMA", "csgo_dsa") if os.environ.get("DB_HOST") else None
+)
+
+match_info_table = Table(
+    "match_info",
+    metadata,
+    Column("match_id", String, primary_key=True),
+    Column("series", Integer, primary_key=True),
+    Column("match_date", Date),
+    Column("winning_team", String),
+    Column("losing_team", String),
+    Column("score", String),
+    Column("winning_t_wins", Integer),
+    Column("winning_ct_wins", Integer),
+    Column("losing_t_wins", Integer),
+    Column("losing_ct_wins", Integer),
+    Column("winning_players", String),
+    Column("losing_players", String),
+    Column("map_name", String),
+    Index("ix_match_info_map_name", "map_name"),
+    Index("ix_match_info_match_date", "match_date"),
+)
+
+# the SQLite engine, and the engines MATCH_INFO has been created on
+_engine = None
+_created = set()
+# versions of the tables MATCH_INFO was last brought up to date with, in this process
+_materialized_versions = None
+
+
+def match_info_engine():
+    """
+    Returns the engine of the database holding MATCH_INFO:
+    Postgres if DB_HOST is set, otherwise a SQLite file in data/.
+    """
+    global _engine
+    if os.environ.get("DB_HOST"):
+        # the pooled engine of this worker
+        engine = get_engine()
+    else:
+        if _engine is None:
+            _engine = create_engine("sqlite:///" + SQLITE_PATH)
+        engine = _engine
+
+    if engine not in _created:
+        metadata.create_all(engine, checkfirst=True)
+        _created.add(engine)
+
+    return engine
+
+
+def materialize_match_info(engine=None):
+    """
+    Builds the summary of the matches in game_round (its csv or ingested
+    partitions) that aren't in MATCH_INFO yet and inserts them.
+    Returns the number of matches added.
+    """
+    engine = engine or match_info_engine()
+
+    with engine.connect() as conn:
+        existing = pd.read_sql(select(match_info_table.c.match_id, match_info_table.c.series), conn)
+
+    existing = set(zip(existing.match_id, existing.series.astype(int)))
+    keys = [
+        (match_id, int(series))
+        for match_id, series in table_matches("game_round")
+        if (match_id, int(series)) not in existing
+    ]
+    if keys == []:
+        return 0
+
+    rounds = get_matches("game_round", keys)
+    summary = build_match_summary(rounds, roster_table(keys))
+    summary["match_date"] = pd.to_datetime(summary.match_date).dt.date
+    rows = summary.astype(object).where(summary.notna(), None).to_dict("records")
+    try:
+        with engine.begin() as conn:
+            conn.execute(match_info_table.insert(), rows)
+    except IntegrityError:
+        # another worker materialized them first
+        return 0
+
+    return len(rows)
+
+
+def query_match_info(map_name, engine=None):
+    """
+    Returns the matches on map_name from MATCH_INFO, newest first,
+    adding any new matches to MATCH_INFO first.
+    """
+    global _materialized_versions
+    engine = engine or match_info_engine()
+
+    versions = data_versions()
+    if versions != _materialized_versions:
+        with _lock:
+            if versions != _materialized_versions:
+                materialize_match_info(engine)
+                _materialized_versions = versions
+
+    query = (
+        select(*[match_info_table.c[col] for col in SUMMARY_COLS])
+        .where(match_info_table.c.map_name == map_name)
+        .order_by(match_info_table.c.match_date.desc())
+    )
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn)
+    df["match_date"] = pd.to_datetime(df.match_date).dt.strftime("%Y-%m-%d")
+
+    return df
+
+
+# map name -> (versions of the tables it came from, matches, their indexes)
+_match_tables = {}
+
+
+def _inverted(keys, rows):
+    index = {}
+    for key, row in zip(keys, rows):
+        index.setdefault(key, set()).add(row)
+
+    return index
+
+
+def build_match_index(summary):
+    """
+    Returns {"dates": match dates, "teams": team -> rows, "players": player -> rows}
+    for a summary sorted by match_date. dates is a sorted datetime64 array and
+    rows is the set of positions in summary of the matches the team/player played in.
+    Players are split out of the roster strings, so they match exactly.
+    """
+    dates = pd.to_datetime(summary.match_date).values
+    rows = np.arange(len(summary))
+    teams = _inverted(
+        np.concatenate([summary.winning_team.values, summary.losing_team.values]),
+        np.concatenate([rows, rows]),
+    )
+
+    rosters = pd.concat(
+        [
+            pd.Series(summary.winning_players.values, index=rows),
+            pd.Series(summary.losing_players.values, index=rows),
+        ]
+    )
+    names = rosters.str.split(", ").explode()
+    names = names.loc[names.notna() & (names != "")]
+    players = _inverted(names.values, names.index)
+
+    return {"dates": dates, "teams": teams, "players": players}
+
+
+def match_table(map_name):
+    """
+    Returns (matches, index): the matches on map_name from MATCH_INFO, oldest first
+    with a RangeIndex, and their indexes (see build_match_index).
+    Both are rebuilt only when the round or roster data changed.
+    """
+    versions = data_versions()
+    cached = _match_tables.get(map_name)
+    if cached is not None and cached[0] == versions:
+        return cached[1], cached[2]
+
+    df = query_match_info(map_name)
+    df = df.sort_values("match_date", kind="stable", ignore_index=True)
+    index = build_match_index(df)
+    _match_tables[map_name] = (versions, df, index)
+
+    return df, index
+
+
+def date_range(index, start_date=None, end_date=None):
+    """
+    Returns (start, stop) such that rows start:stop are the matches played
+    from start_date to end_date (i.e. '2023-06-05', both inclusive, None for no bound),
+    with a binary search on the sorted dates.
+    """
+    dates = index["dates"]
+    start = 0
+    stop = len(dates)
+    if start_date is not None:
+        start = dates.searchsorted(np.datetime64(str(start_date)[:10]), side="left")
+    if end_date is not None:
+        end = np.datetime64(str(end_date)[:10]) + np.timedelta64(1, "D")
+        stop = dates.searchsorted(end, side="left")
+
+    return start, max(start, stop)
+
+
+def select_matches(index, teams=(), players=(), start_date=None, end_date=None):
+    """
+    Returns the rows of the matches from start_date to end_date that every one
+    of teams and players played in, newest first.
+    """
+    start, stop = date_range(index, start_date, end_date)
+
+    selected = [index["teams"].get(team, set()) for team in teams]
+    selected += [index["players"].get(player, set()) for player in players]
+    if selected == []:
+        rows = np.arange(start, stop)
+    else:
+        rows = np.array(sorted(set.intersection(*selected)), dtype=int)
+        rows = rows[(rows >= start) & (rows < stop)]
+
+    return rows[::-1]
+
+
+if __name__ == "__main__":
+    print("added " + str(materialize_match_info()) + " matches to match_info")
@@ -0,0 +1,96 @@
+"""
+This is the Postgres data access for the match pool: the kill, round,
+damage and match rows of a list of (match_id, series). The match ids and
+serieses are bound as two array parameters, unnested into the pool's
+(match_id, series) pairs, instead of pasted into an IN (...) list,
+the four queries run at the same time on pooled connections, and each
+result is streamed with COPY into a csv buffer and parsed straight
+into a typed DataFrame, so no python row tuples are built.
+Currently there's
+POOL_QUERIES - dictionary of table names to their query, with %(ids)s and %(series)s array parameters
+copy_frame - function to run one query through COPY into a DataFrame
+fetch_match_pool - function to fetch every table of the pool at once
+"""
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from data_store import read_typed_csv
+from db import read_engine
+
+# the (match_id, series) pairs of the pool, the casts keep an empty pool valid
+POOL_KEYS = "SELECT * FROM unnest(%(ids)s::text[], %(series)s::int[])"
+
+POOL_QUERIES = {
+    "kills": """ SELECT *
+                FROM CSGO_DSA.HLTV_KILL
+                WHERE (MATCH_ID, SERIES) IN (""" + POOL_KEYS + """)
+                ORDER BY MATCH_ID, SERIES, TICK ASC
+    """,
+    "game_round": """ SELECT *
+                FROM CSGO_DSA.HLTV_GAME_ROUND
+                WHERE (MATCH_ID, SERIES) IN (""" + POOL_KEYS + """)
+                ORDER BY MATCH_ID, SERIES
+    """,
+    "damage": """ SELECT *
+                FROM CSGO_DSA.HLTV_DAMAGE
+                WHERE (MATCH_ID, SERIES) IN (""" + POOL_KEYS + """)
+                ORDER BY MATCH_ID, SERIES
+    """,
+    # the metadata is per match, every series of it shares it
+    "match": """ SELECT MATCH_URN as ID,
+                extra_metadata as metadata
+                FROM CSGO_DSA.MATCH_GAME
+                WHERE MATCH_URN = ANY(%(ids)s::text[])
+                ORDER BY ID
+    """,
+}
+
+
+def copy_frame(engine, query, params):
+    """
+    Runs query with params on a pooled connection of engine and returns the
+    result as a typed DataFrame. The parameters are bound by the driver, then
+    the query is wrapped in COPY ... TO STDOUT so the rows come back as csv.
+    """
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        bound = cursor.mogrify(query, params).decode()
+        buffer = io.StringIO()
+        cursor.copy_expert(
+            "COPY (" + bound.strip() + ") TO STDOUT WITH CSV HEADER", buffer
+        )
+        cursor.close()
+        conn.commit()
+    finally:
+        # back to the pool
+        conn.close()
+
+    buffer.seek(0)
+    return read_typed_csv(buffer)
+
+
+def fetch_match_pool(keys, engine=None):
+    """
+    Returns {"kills", "game_round", "damage", "match"} DataFrames for the
+    (match_id, series) in keys, fetched concurrently from the read replica
+    (if there's one). The match metadata is parsed back into dicts.
+    Database errors are raised as is.
+    """
+    engine = engine or read_engine()
+    keys = list(keys)
+    params = {
+        "ids": [str(match_id) for match_id, _ in keys],
+        "series": [int(series) for _, series in keys],
+    }
+
+    with ThreadPoolExecutor(max_workers=len(POOL_QUERIES)) as executor:
+        futures = {
+            name: executor.submit(copy_frame, engine, query, params)
+            for name, query in POOL_QUERIES.items()
+        }
+        frames = {name: future.result() for name, future in futures.items()}
+
+    frames["match"]["metadata"] = frames["match"].metadata.map(json.loads)
+
+    return frames
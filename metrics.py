@@ -0,0 +1,253 @@
+"""
+This is the instrumentation of the app's callbacks. Every callback
+registered after instrument_callbacks(app) is timed, along with the
+size of its inputs and outputs (as the json dash sends) and the prop
+that triggered it (component.prop). The numbers go into in-process
+histograms, served in the Prometheus text format on /metrics, and
+callbacks slower than SLOW_CALLBACK_SECONDS are logged as one json line each.
+Each worker keeps its own numbers, so scrape every worker.
+Currently there's
+Histogram - class for a cumulative histogram with Prometheus-style buckets
+timed - function to wrap a callback so it records its metrics
+instrument_callbacks - function to make app.callback wrap every callback with timed
+add_metrics_route - function to serve the metrics on /metrics of a flask server
+
+Set METRICS_SIZES=0 to skip measuring payload sizes (it serializes them
+one more time), and SLOW_CALLBACK_SECONDS=0 to turn off the slow callback logs.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from functools import wraps
+from dash import ctx
+from dash.exceptions import PreventUpdate
+from flask import Response
+from plotly.io.json import to_json_plotly
+
+SLOW_CALLBACK_SECONDS = float(os.environ.get("SLOW_CALLBACK_SECONDS", 1.0))
+MEASURE_SIZES = os.environ.get("METRICS_SIZES", "1") != "0"
+
+TIME_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]
+
+logger = logging.getLogger("csgo.metrics")
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    A cumulative histogram per label value, i.e. one per callback.
+    """
+
+    def __init__(self, name, help, buckets, label):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # label value -> [count per bucket (+inf last), sum]
+        self.values = {}
+
+    def observe(self, label_value, value):
+        with _lock:
+            counts, total = self.values.get(label_value, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.values[label_value] = (counts, total + value)
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " histogram"]
+        with _lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self.values.items()}
+        for label_value, (counts, total) in sorted(values.items()):
+            label = self.label + '="' + _escape(label_value) + '"'
+            for bound, count in zip(self.buckets + ["+Inf"], counts):
+                lines.append(
+                    self.name + "_bucket{" + label + ',le="' + str(bound) + '"} ' + str(count)
+                )
+            lines.append(self.name + "_sum{" + label + "} " + repr(float(total)))
+            lines.append(self.name + "_count{" + label + "} " + str(counts[-1]))
+
+        return lines
+
+
+class Counter:
+    """
+    A counter per combination of label values.
+    """
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " counter"]
+        with _lock:
+            values = dict(self.values)
+        for label_values, count in sorted(values.items()):
+            labels = ",".join(
+                label + '="' + _escape(value) + '"'
+                for label, value in zip(self.labels, label_values)
+            )
+            lines.append(self.name + "_total{" + labels + "} " + str(count))
+
+        return lines
+
+
+duration = Histogram(
+    "dash_callback_duration_seconds", "Wall time of a callback.", TIME_BUCKETS, "callback"
+)
+input_size = Histogram(
+    "dash_callback_input_bytes", "Size of a callback's inputs and states as json.", SIZE_BUCKETS, "callback"
+)
+output_size = Histogram(
+    "dash_callback_output_bytes", "Size of a callback's outputs as json.", SIZE_BUCKETS, "callback"
+)
+calls = Counter(
+    "dash_callback_calls", "Callback calls by trigger and outcome.", ["callback", "trigger", "outcome"]
+)
+
+METRICS = [duration, input_size, output_size, calls]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def json_size(value):
+    """
+    Returns the size in bytes of value as json, the way dash would send it.
+    """
+    try:
+        return len(to_json_plotly(value))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+def trigger_name(prop_id):
+    """
+    Returns the prop that triggered a callback, as "component.prop", with
+    pattern-matching ids reduced to their type so each team/player doesn't
+    get its own label.
+
+    >>> trigger_name("graph.clickData")
+    'graph.clickData'
+    >>> trigger_name('{"index":"Nouns esports","type":"team-selector-data"}.data')
+    'team-selector-data.data'
+    >>> trigger_name(".")
+    'none'
+    """
+    if not prop_id or prop_id == ".":
+        return "none"
+    component, prop = prop_id.rsplit(".", 1)
+    if component.startswith("{"):
+        try:
+            component = str(json.loads(component).get("type"))
+        except ValueError:
+            pass
+
+    return component + "." + prop
+
+
+def timed(func):
+    """
+    Wraps a callback so every call records its wall time, input/output sizes
+    and trigger, and gets logged if it's slow.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            trigger = trigger_name(ctx.triggered[0]["prop_id"])
+        except Exception:
+            # outside of a request, i.e. called directly
+            trigger = "none"
+        outcome = "ok"
+        output = None
+
+        start = time.perf_counter()
+        try:
+            output = func(*args, **kwargs)
+            return output
+        except PreventUpdate:
+            outcome = "prevented"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            duration.observe(name, seconds)
+            calls.inc(name, trigger, outcome)
+
+            sizes = {}
+            if MEASURE_SIZES:
+                sizes["input_bytes"] = json_size([args, kwargs])
+                input_size.observe(name, sizes["input_bytes"])
+                if outcome == "ok":
+                    sizes["output_bytes"] = json_size(output)
+                    output_size.observe(name, sizes["output_bytes"])
+
+            if SLOW_CALLBACK_SECONDS > 0 and seconds >= SLOW_CALLBACK_SECONDS:
+                logger.warning(
+                    json.dumps(
+                        dict(
+                            event="slow_callback",
+                            callback=name,
+                            seconds=round(seconds, 3),
+                            trigger=trigger,
+                            outcome=outcome,
+                            **sizes,
+                        )
+                    )
+                )
+
+    return wrapper
+
+
+def instrument_callbacks(app):
+    """
+    Makes app.callback wrap every callback it registers from now on with timed.
+    """
+    register = app.callback
+
+    @wraps(register)
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def wrap(func):
+            return decorator(timed(func))
+
+        return wrap
+
+    app.callback = callback
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+
+    return "\n".join(lines) + "\n"
+
+
+def add_metrics_route(server, path="/metrics"):
+    """
+    Serves the metrics of this worker on path, in the Prometheus text format.
+    """
+    server.add_url_rule(
+        path,
+        "metrics",
+        lambda: Response(render_metrics(), mimetype="text/plain; version=0.0.4"),
+    )
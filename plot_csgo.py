@@ -3,12 +3,19 @@ This is a library to use in making plotly plots of
 csgo data. Currently there's
 map_dict - dictionary of map coordinates for calibration
 find_scale - function to align game data to png map scale
+get_radar - function to get a map's (preloaded) radar url, size and transform
+radar_url - function to get the static asset url of a map's radar (or its thumbnail)
+connection_trace - function to draw lines from attackers to their victims
+hltv_link - function to get the (cached) HLTV link of a kill without waiting on the network
 plot - function to plot coordinate data on top of csgo maps
 """
+import os
+import threading
 import numpy as np
 from PIL import Image
 import plotly.graph_objects as go
 import webbrowser
+from hltv_links import cached_link
 
 # these are all the coordinates used to calibrate the data scaling function that follows
 map_dict = {
@@ -81,6 +88,139 @@ def find_scale(game_x, game_y, map_x, map_y):
     return x, y, s
 
 
+# the radars are served by dash from the assets folder, the plots only reference their url
+MAP_IMAGE_DIR = os.path.join("assets", "map_images")
+MAP_IMAGE_URL = "assets/map_images/"
+THUMBNAIL_DIR = os.path.join(MAP_IMAGE_DIR, "thumbnails")
+THUMBNAIL_WIDTH = 256
+
+# map string (i.e. 'nuke_lower') -> radar info, filled once per process by get_radar
+radars = {}
+_radar_lock = threading.Lock()
+
+
+def radar_path(map_string, thumbnail=False):
+    return os.path.join(
+        THUMBNAIL_DIR if thumbnail else MAP_IMAGE_DIR, "de_" + map_string + "_radar.jpg"
+    )
+
+
+def make_thumbnail(map_string):
+    """
+    Writes a THUMBNAIL_WIDTH wide copy of a radar, if it's missing or older than the radar.
+    """
+    path = radar_path(map_string, thumbnail=True)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(radar_path(map_string)):
+        return
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    with Image.open(radar_path(map_string)) as I:
+        I = I.convert("RGB")
+        I.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH))
+        I.save(path, quality=85)
+
+
+def radar_url(map_string, thumbnail=False):
+    """
+    Returns the url of a radar in the assets folder, with its modification time
+    as a query string so browsers can cache it for good.
+    """
+    if thumbnail:
+        make_thumbnail(map_string)
+    path = radar_path(map_string, thumbnail)
+
+    return (
+        MAP_IMAGE_URL
+        + ("thumbnails/" if thumbnail else "")
+        + os.path.basename(path)
+        + "?m="
+        + str(int(os.path.getmtime(path)))
+    )
+
+
+def load_radar(map_string):
+    """
+    Reads a radar image once and keeps what the plots need from it:
+    size - (w, h) of the image
+    source - the url of the image, so plotly doesn't embed it in every figure
+    transform - (x_shift, y_shift, s) from find_scale, None if the map isn't calibrated
+    Lower levels (i.e. 'nuke_lower') use the calibration of the upper level.
+    """
+    with Image.open(radar_path(map_string)) as I:
+        size = I.size
+
+    calibration = map_string.replace("_lower", "")
+    transform = None
+    if calibration + "_game_x" in map_dict:
+        transform = find_scale(
+            map_dict[calibration + "_game_x"],
+            map_dict[calibration + "_game_y"],
+            map_dict[calibration + "_map_x"],
+            map_dict[calibration + "_map_y"],
+        )
+
+    return {
+        "size": size,
+        "source": radar_url(map_string),
+        "transform": transform,
+    }
+
+
+def get_radar(map_string):
+    """
+    Returns the radar info of a map (see load_radar), loading it the first time.
+    """
+    if map_string not in radars:
+        with _radar_lock:
+            if map_string not in radars:
+                radars[map_string] = load_radar(map_string)
+
+    return radars[map_string]
+
+
+def preload_radars():
+    """
+    Loads the radar of every map with an image in MAP_IMAGE_DIR.
+    """
+    for f in sorted(os.listdir(MAP_IMAGE_DIR)):
+        if f.startswith("de_") and f.endswith("_radar.jpg"):
+            get_radar(f[len("de_") : -len("_radar.jpg")])
+
+
+def connection_trace(df):
+    """
+    This function makes a single dotted line trace connecting the
+    attacker and victim of every kill in df. The segments are
+    separated by NaNs, so plotly doesn't join them.
+    """
+    x = np.full(3 * len(df), np.nan)
+    y = np.full(3 * len(df), np.nan)
+    x[0::3], y[0::3] = df.attacker_x.values, df.attacker_y.values
+    x[1::3], y[1::3] = df.victim_x.values, df.victim_y.values
+
+    return go.Scatter(
+        x=x,
+        y=y,
+        mode="lines",
+        hoverinfo="skip",
+        line=dict(
+            color="rgb(46, 154, 255)",
+            width=2,
+            dash="dot",
+        ),
+    )
+
+
+def hltv_link(row):
+    """
+    Returns the HLTV link of the match of a kill, from the kill itself or the
+    link cache. If it's not resolved yet this queues a lookup and returns None.
+    """
+    if isinstance(row.get("hltv_link"), str):
+        return row["hltv_link"]
+
+    return cached_link(row.get("source_match_filename"))
+
+
 def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, highlight_index):
     """
     This function produces a plotly plot with heatmaps and scatters
@@ -98,14 +238,18 @@ def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, hig
     """
     df_victim = dfs[0].copy()
     df_attacker = dfs[1].copy()
+    # hover text is built by string concatenation, which categoricals don't support
+    for dff in [df_victim, df_attacker]:
+        for col in dff.select_dtypes("category").columns:
+            dff[col] = dff[col].astype(object)
     # Add image
-    I = Image.open("map_images/de_" + map_string + "_radar.jpg")
-    w, h = I.size
+    radar = get_radar(map_string)
+    w, h = radar["size"]
     fig = go.Figure()
 
     fig.add_layout_image(
         dict(
-            source=I,
+            source=radar["source"],
             xref="x",
             yref="y",
             x=0,
@@ -213,44 +357,30 @@ def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, hig
             )
             # add highlight trace
             if "Victim/Killer connection" == graph_tool:
-                
-                for i in selected_victim_index:
-                    fig.add_shape(
-                        type="line",
-                        x0=float(df_victim[df_victim['index']==i].attacker_x),
-                        y0=float(df_victim[df_victim['index']==i].attacker_y),
-                        x1=float(df_victim[df_victim['index']==i].victim_x),
-                        y1=float(df_victim[df_victim['index']==i].victim_y),
-                        line=dict(
-                            color="rgb(46, 154, 255)",
-                            width=2,
-                            dash="dot",
-                        ),
-                    )
+                selected_victims = df_victim.loc[df_victim['index'].isin(selected_victim_index)]
+                fig.add_trace(trace=connection_trace(selected_victims))
                 fig.add_trace(
                     trace=go.Scatter(
-                        x=df_victim.loc[df_victim['index'].isin(selected_victim_index)].attacker_x,
-                        y=df_victim.loc[df_victim['index'].isin(selected_victim_index)].attacker_y,
+                        x=selected_victims.attacker_x,
+                        y=selected_victims.attacker_y,
                         hoverinfo="text",
                         text="name: "
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].attacker_name
+                        + selected_victims.attacker_name
                         + "<br>"
                         + "victim: "
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].victim_name
+                        + selected_victims.victim_name
                         + "<br>"
                         + "weapon: "
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].weapon
+                        + selected_victims.weapon
                         + "<br>"
                         + "seconds: "
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].true_round_time.apply(
-                            lambda x: str(x)
-                        )
+                        + selected_victims.true_round_time.apply(lambda x: str(x))
                         + "<br>"
                         + "side:"
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].attacker_side
+                        + selected_victims.attacker_side
                         + "<br>"
                         + "dmg dealt:"
-                        + df_victim.loc[df_victim['index'].isin(selected_victim_index)].damage_taken.apply(lambda x: str(x)),
+                        + selected_victims.damage_taken.apply(lambda x: str(x)),
                         mode="markers",
                         marker_symbol="circle",
                         marker_color="rgb(35, 201, 2)",
@@ -268,7 +398,9 @@ def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, hig
 
                 if click_data is not None:
                     try:
-                        webbrowser.open_new(df_victim.loc[click_data["points"][0]["customdata"]].hltv_link)
+                        link = hltv_link(df_victim.loc[click_data["points"][0]["customdata"]])
+                        if link is not None:
+                            webbrowser.open_new(link)
                     except:
                         pass
             elif graph_tool == "Highlight player":
@@ -315,43 +447,30 @@ def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, hig
             )
             
             if "Victim/Killer connection" == graph_tool:
-                for i in selected_attacker_index:
-                    fig.add_shape(
-                        type="line",
-                        x0=float(df_attacker[df_attacker['index'].isin(selected_attacker_index)].attacker_x),
-                        y0=float(df_attacker[df_attacker['index'].isin(selected_attacker_index)].attacker_y),
-                        x1=float(df_attacker[df_attacker['index'].isin(selected_attacker_index)].victim_x),
-                        y1=float(df_attacker[df_attacker['index'].isin(selected_attacker_index)].victim_y),
-                        line=dict(
-                            color="rgb(46, 154, 255)",
-                            width=2,
-                            dash="dot",
-                        ),
-                    )
+                selected_attackers = df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)]
+                fig.add_trace(trace=connection_trace(selected_attackers))
                 fig.add_trace(
                     trace=go.Scatter(
-                        x=df_attacker[df_attacker['index'].isin(selected_attacker_index)].victim_x,
-                        y=df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].victim_y,
+                        x=selected_attackers.victim_x,
+                        y=selected_attackers.victim_y,
                         hoverinfo="text",
                         text="name: "
-                        + df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].victim_name
+                        + selected_attackers.victim_name
                         + "<br>"
                         + "attacker: "
-                        + df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].attacker_name
+                        + selected_attackers.attacker_name
                         + "<br>"
                         + "killed with: "
-                        + df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].weapon
+                        + selected_attackers.weapon
                         + "<br>"
                         + "seconds: "
-                        + df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].true_round_time.apply(
-                            lambda x: str(x)
-                        )
+                        + selected_attackers.true_round_time.apply(lambda x: str(x))
                         + "<br>"
                         + "side:"
-                        + df_attacker.loc[df_attacker['index'].isin(selected_attacker_index)].victim_side
+                        + selected_attackers.victim_side
                         + "<br>"
                         + "net dmg:"
-                        + df_attacker[df_attacker['index'].isin(selected_attacker_index)].net_dmg.apply(lambda x: str(x)),
+                        + selected_attackers.net_dmg.apply(lambda x: str(x)),
                         mode="markers",
                         marker_symbol="x",
                         marker_color="rgb(255,0,0)",
@@ -369,7 +488,9 @@ def plot(dfs, map_string, plot_types, selected_data, click_data, graph_tool, hig
 
                 if click_data is not None:
                     try:
-                        webbrowser.open_new(df_attacker.loc[click_data["points"][0]["customdata"]].hltv_link)
+                        link = hltv_link(df_attacker.loc[click_data["points"][0]["customdata"]])
+                        if link is not None:
+                            webbrowser.open_new(link)
                     except:
                         pass
             elif graph_tool == "Highlight player":
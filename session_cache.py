@@ -0,0 +1,201 @@
+"""
+This is a server-side cache for the dataframes the callbacks pass
+to each other. The dcc.Stores in the page only hold the key of a frame,
+the frame itself stays in memory here, and is written in the background
+to local disk in CACHE_DIR so any worker on the same machine can pick it up.
+Each session gets a memory budget, when it's over budget its least
+recently used frames are dropped from memory (they stay on disk).
+The disk is shared by every session, files that weren't read or written
+for DISK_TTL are deleted, and then the least recently used ones until the
+whole directory fits in DISK_BUDGET. A worker asked for a frame another
+worker is still writing waits up to WRITE_WAIT for it.
+Currently there's
+FrameMissing - exception for a key whose frame isn't cached anymore
+put_frame - function to cache a frame for a session, returns its key
+get_frame - function to get a cached frame back from its key
+"""
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# owned by the app (not the shared temp directory), the pickles are loaded back
+CACHE_DIR = os.environ.get(
+    "SESSION_CACHE_DIR", os.path.join("data", ".cache", "session_frames")
+)
+# budgets in bytes, per session and for the whole worker, in memory
+SESSION_BUDGET = int(os.environ.get("SESSION_CACHE_MB", 256)) * 2**20
+TOTAL_BUDGET = int(os.environ.get("SESSION_CACHE_TOTAL_MB", 1024)) * 2**20
+# budget in bytes and age in seconds of CACHE_DIR, for every session together
+DISK_BUDGET = int(os.environ.get("SESSION_CACHE_DISK_MB", 2048)) * 2**20
+DISK_TTL = float(os.environ.get("SESSION_CACHE_TTL_HOURS", 12)) * 3600
+# seconds between two sweeps of CACHE_DIR
+SWEEP_INTERVAL = 60
+# seconds to wait for a frame another worker hasn't written to disk yet
+WRITE_WAIT = float(os.environ.get("SESSION_CACHE_WAIT", 5))
+
+logger = logging.getLogger("csgo.session_cache")
+
+# key -> (session_id, frame, size in bytes), least recently used first
+_frames = OrderedDict()
+_lock = threading.Lock()
+
+# one thread writes the pickles and sweeps the directory, off the callbacks' path
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-cache")
+
+_last_sweep = 0
+
+_key_pattern = re.compile(r"[0-9a-zA-Z_]+-[0-9a-f]{32}")
+
+
+class FrameMissing(KeyError):
+    """
+    The frame of a key is neither in memory nor on disk, i.e. it was swept.
+    """
+
+
+def frame_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def frame_path(key):
+    return os.path.join(CACHE_DIR, key + ".pkl")
+
+
+def _remember(key, session_id, df):
+    """
+    Puts a frame in memory and evicts least recently used frames,
+    first from its own session, then from everyone.
+    """
+    with _lock:
+        _frames[key] = (session_id, df, frame_size(df))
+        _frames.move_to_end(key)
+
+        session_keys = [k for k, v in _frames.items() if v[0] == session_id]
+        session_total = sum(_frames[k][2] for k in session_keys)
+        for k in session_keys[:-1]:
+            if session_total <= SESSION_BUDGET:
+                break
+            session_total -= _frames.pop(k)[2]
+
+        total = sum(v[2] for v in _frames.values())
+        for k in list(_frames)[:-1]:
+            if total <= TOTAL_BUDGET:
+                break
+            total -= _frames.pop(k)[2]
+
+
+def _sweep_disk():
+    """
+    Deletes the files of every session that are older than DISK_TTL,
+    then the oldest ones until CACHE_DIR fits in DISK_BUDGET.
+    """
+    now = time.time()
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            stat = entry.stat()
+            if now - stat.st_mtime > DISK_TTL:
+                os.remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= DISK_BUDGET:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _write(key, df):
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        tmp = frame_path(key) + "." + str(os.getpid()) + ".tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, frame_path(key))
+        global _last_sweep
+        if time.time() - _last_sweep > SWEEP_INTERVAL:
+            _last_sweep = time.time()
+            _sweep_disk()
+    except OSError:
+        # the frame is still in memory, other workers just won't see it
+        pass
+
+
+def put_frame(session_id, df):
+    """
+    Caches df for the session and returns the key to put in a dcc.Store.
+    The frame is written to disk in the background.
+    Callers shouldn't modify df afterwards.
+    """
+    session_id = re.sub(r"[^0-9a-zA-Z_]", "", str(session_id)) or "anon"
+    key = session_id + "-" + uuid.uuid4().hex
+
+    _remember(key, session_id, df)
+    _writer.submit(_write, key, df)
+
+    return key
+
+
+def _touch(key):
+    # the sweep goes by mtime, so frames that are still read stay on disk
+    try:
+        os.utime(frame_path(key))
+    except OSError:
+        pass
+
+
+def _read(key):
+    """
+    Reads a frame from disk, waiting up to WRITE_WAIT for it to show up
+    in case the worker that made it is still writing it.
+    """
+    deadline = time.monotonic() + WRITE_WAIT
+    while True:
+        try:
+            return pd.read_pickle(frame_path(key))
+        except FileNotFoundError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+
+def get_frame(key):
+    """
+    Returns the frame cached under key, or an empty frame if key is None
+    (nothing was cached yet). Raises FrameMissing if the frame isn't cached
+    anymore. The frame is shared, copy it before modifying it.
+    """
+    if key is None:
+        return pd.DataFrame()
+    if not _key_pattern.fullmatch(str(key)):
+        raise FrameMissing(key)
+
+    with _lock:
+        cached = _frames.get(key)
+        if cached is not None:
+            _frames.move_to_end(key)
+    if cached is not None:
+        _touch(key)
+        return cached[1]
+
+    try:
+        df = _read(key)
+    except (OSError, ValueError) as e:
+        logger.warning("frame %s is not cached anymore: %s", key, e)
+        raise FrameMissing(key) from e
+    _touch(key)
+    _remember(key, key.rsplit("-", 1)[0], df)
+
+    return df
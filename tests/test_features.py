@@ -0,0 +1,29 @@
+import os
+import shutil
+import pandas as pd
+import features
+from data_store import get_pool
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_features_are_recomputed_when_a_source_table_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    for name in ["kills.csv", "game_round.csv", "damage.csv"]:
+        shutil.copy(os.path.join(REPO, "data", name), "data")
+    keys = features.all_matches()[:1]
+
+    kill_df, _, _ = get_pool(keys)
+    before = features.pool_features(keys, kill_df.index).net_dmg
+
+    damage = pd.read_csv("data/damage.csv")
+    damage["hp_damage_taken"] *= 3
+    damage.to_csv("data/damage.csv", index=False)
+
+    kill_df, round_df, damage_df = get_pool(keys)
+    served = features.pool_features(keys, kill_df.index).net_dmg
+    fresh = features.compute_features(kill_df, round_df, damage_df).net_dmg
+
+    assert not before.equals(served)
+    pd.testing.assert_series_equal(served.loc[fresh.index], fresh, check_names=False)
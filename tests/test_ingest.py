@@ -0,0 +1,28 @@
+import os
+import pandas as pd
+import data_store
+from ingest import ingest_table
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_pool_of_ingested_and_csv_matches_has_unique_row_ids(tmp_path, monkeypatch):
+    kills = pd.read_csv(os.path.join(REPO, "data", "kills.csv"))
+    (a, b) = list(kills.groupby(["match_id", "series"]).groups)[:2]
+    in_a = (kills.match_id == a[0]) & (kills.series == a[1])
+    in_b = (kills.match_id == b[0]) & (kills.series == b[1])
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    # a comes first in the csv, so b's csv row numbers start after a's
+    pd.concat([kills[in_a], kills[in_b]]).to_csv("data/kills.csv", index=False)
+    # only b is ingested, its row ids must not collide with a's csv row numbers
+    kills[in_b].to_csv("b.csv", index=False)
+    assert ingest_table("kills", "b.csv") == 1
+
+    pool = data_store.get_matches("kills", [a, b])
+
+    assert len(pool) == in_a.sum() + in_b.sum()
+    assert pool.index.is_unique
+    from_b = (pool.match_id == b[0]) & (pool.series == b[1])
+    assert (pool.index[from_b.values] >= data_store.INGESTED_ROW_BASE).all()